@@ -10,33 +10,91 @@ DB_CONFIG = {
     'max_size': 10
 }
 
+# 连接池配置
+DB_POOL_CONFIG = {
+    'max_connections_budget': 40,  # 所有下载进程合计可使用的最大连接数
+    'pgbouncer': False,  # 经pgbouncer事务池模式连接时关闭预编译语句缓存
+}
+
 # 交易所API配置
 EXCHANGE_CONFIG = {
     'okex': {
         'base_url': 'https://www.okx.com',
         'spot_endpoint': '/api/v5/market/history-candles',
         'futures_endpoint': '/api/v5/market/history-candles',
+        'ticker_endpoint': '/api/v5/market/tickers',
+        'kline_limit': 100,  # 单次请求最多返回的K线数量
+        'rate_limit': {'weight_per_second': 10, 'burst': 20},  # 每个出口IP的请求权重预算
+        'kline_weight': {'spot': 1, 'futures': 1},  # 单次K线请求的权重
+        'ticker_weight': {'spot': 1, 'futures': 1},  # 单次批量行情请求的权重
+        'symbols_weight': {'spot': 1, 'futures': 1},  # get_symbols 每个市场一次请求的权重
         'timeframe_map': {
             '1m': '1m', '5m': '5m', '15m': '15m',
             '1h': '1H', '4h': '4H', '1d': '1Dutc',
+        },
+        # 永续合约的其他数据集，limit为单次请求最多返回的条数；
+        # interval_hours为资金费率的结算间隔，retention_days为交易所只保留最近多少天的数据
+        'datasets': {
+            'funding_rate': {
+                'endpoint': '/api/v5/public/funding-rate-history', 'limit': 100, 'weight': 1, 'interval_hours': 8,
+            },
+            'open_interest': {
+                'endpoint': '/api/v5/rubik/stat/contracts/open-interest-history', 'limit': 100, 'weight': 1,
+                'timeframe_map': {'5m': '5m', '15m': '15m', '1h': '1H', '4h': '4H', '1d': '1Dutc'},
+            },
+            'mark_price': {'endpoint': '/api/v5/market/history-mark-price-candles', 'limit': 100, 'weight': 1},
         }
     },
     'bybit': {
         'base_url': 'https://api.bybit.com',
         'spot_endpoint': '/v5/market/kline',
         'futures_endpoint': '/v5/market/kline',
+        'ticker_endpoint': '/v5/market/tickers',
+        'kline_limit': 500,
+        'rate_limit': {'weight_per_second': 10, 'burst': 20},
+        'kline_weight': {'spot': 1, 'futures': 1},
+        'ticker_weight': {'spot': 1, 'futures': 1},
+        'symbols_weight': {'spot': 1, 'futures': 1},
         'timeframe_map': {
             '1m': '1', '5m': '5', '15m': '15',
             '1h': '60', '4h': '240', '1d': 'D'
+        },
+        'datasets': {
+            'funding_rate': {'endpoint': '/v5/market/funding/history', 'limit': 200, 'weight': 1, 'interval_hours': 8},
+            'open_interest': {
+                'endpoint': '/v5/market/open-interest', 'limit': 200, 'weight': 1,
+                'timeframe_map': {'5m': '5min', '15m': '15min', '1h': '1h', '4h': '4h', '1d': '1d'},
+            },
+            'mark_price': {'endpoint': '/v5/market/mark-price-kline', 'limit': 1000, 'weight': 1},
         }
     },
     'binance': {
         'base_url': 'https://api.binance.com',
         'spot_endpoint': 'https://api.binance.com/api/v3/klines',
         'futures_endpoint': 'https://fapi.binance.com/fapi/v1/klines',
+        'spot_ticker_endpoint': 'https://api.binance.com/api/v3/ticker/24hr',
+        'futures_ticker_endpoint': 'https://fapi.binance.com/fapi/v1/ticker/24hr',
+        'kline_limit': 1000,
+        'rate_limit': {'weight_per_second': 20, 'burst': 100},
+        'kline_weight': {'spot': 2, 'futures': 5},
+        'ticker_weight': {'spot': 80, 'futures': 40},
+        'symbols_weight': {'spot': 20, 'futures': 1},  # exchangeInfo
         'timeframe_map': {
             '1m': '1m', '5m': '5m', '15m': '15m',
             '1h': '1h', '4h': '4h', '1d': '1d'
+        },
+        'datasets': {
+            'funding_rate': {
+                'endpoint': 'https://fapi.binance.com/fapi/v1/fundingRate', 'limit': 1000, 'weight': 1,
+                'interval_hours': 8,
+            },
+            # 持仓量历史只保留最近30天
+            'open_interest': {
+                'endpoint': 'https://fapi.binance.com/futures/data/openInterestHist', 'limit': 500, 'weight': 1,
+                'retention_days': 30,
+                'timeframe_map': {'5m': '5m', '15m': '15m', '1h': '1h', '4h': '4h', '1d': '1d'},
+            },
+            'mark_price': {'endpoint': 'https://fapi.binance.com/fapi/v1/markPriceKlines', 'limit': 1000, 'weight': 5},
         }
     }
 }
@@ -49,3 +107,54 @@ DEFAULT_DOWNLOAD_CONFIG = {
     'timeframe': '1d',
     'max_concurrent_tasks': 1
 }
+
+# 下载任务优先级调度配置
+PRIORITY_CONFIG = {
+    # 任务通道，按优先级从高到低排列，reserved为该通道的预留并发数
+    'lanes': [
+        {'name': 'live', 'reserved': 1},  # 最新K线
+        {'name': 'repair', 'reserved': 1},  # 缺口修复
+        {'name': 'backfill', 'reserved': 1},  # 历史回填
+    ],
+    'live_window': 24 * 60 * 60,  # 结束时间在最近多少秒内的窗口归入live通道
+    'batch_size': 1000,  # 每个通道每次展开的窗口数，避免一次生成全部窗口
+}
+
+# 分布式工作模式配置
+WORKER_CONFIG = {
+    'concurrency': 4,  # 每个工作进程同时执行的任务数
+    'lease_seconds': 120,  # 任务租约时长，超时未续约的任务可被其他工作进程领取
+    'heartbeat_seconds': 30,  # 续约间隔
+    'poll_seconds': 5,  # 没有可领取任务时的轮询间隔
+    'max_attempts': 5,  # 任务最大尝试次数
+}
+
+# 常驻调度器配置
+SCHEDULER_CONFIG = {
+    'interval_minutes': 15,  # 调度间隔，tick对齐到该周期的K线收盘边界
+    'delay_seconds': 10,  # 收盘后等待交易所落盘的时间
+    'symbols_ttl': 3600,  # 工作进程缓存交易对列表的时间(秒)
+    'max_concurrent_tasks': 3,  # 每个交易所进程在一次tick中的下载并发数
+}
+
+# 请求重试与熔断配置
+RETRY_CONFIG = {
+    'max_retries': 4,  # 最大重试次数
+    'base_delay': 0.5,  # 重试等待的下限(秒)
+    'max_delay': 30,  # 重试等待的上限(秒)
+    'failure_threshold': 5,  # 同一endpoint连续失败多少次后熔断
+    'reset_timeout': 30,  # 熔断持续时间(秒)
+}
+
+# 下载流程分析配置，下载命令加 --profile 时生效
+PROFILE_CONFIG = {
+    'output_dir': 'profiles',  # 各进程的阶段耗时(.stages.json)和折叠栈(.collapsed)输出目录
+    'sample_interval': 0.005,  # 采样间隔(秒)，0表示只统计阶段耗时
+}
+
+# HTTP响应缓存配置
+HTTP_CACHE_CONFIG = {
+    'enabled': True,
+    'cache_dir': '.http_cache',  # 已收盘历史窗口的响应持久化目录
+    'ttl': 30,  # 包含当前时间的窗口的内存缓存有效期(秒)
+}
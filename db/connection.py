@@ -1,20 +1,78 @@
 """数据库连接管理"""
+import asyncio
+import contextlib
+import time
+
 import asyncpg
 
 from conf import config
 
 
+class PreparedConnection(asyncpg.Connection):
+    """按SQL文本缓存显式预编译语句的连接"""
+
+    __slots__ = ('_prepared_statements',)
+
+    async def prepared(self, query):
+        """获取(必要时创建)预编译语句，连接存活期间复用"""
+        try:
+            statements = self._prepared_statements
+        except AttributeError:
+            statements = self._prepared_statements = {}
+
+        statement = statements.get(query)
+        if statement is None:
+            statement = statements[query] = await self.prepare(query)
+        return statement
+
+
 class DatabaseManager:
     """数据库连接管理器"""
 
     def __init__(self):
         self.pool = None
+        self._loop = None
+        self.min_size = config.DB_CONFIG['min_size']
+        self.max_size = config.DB_CONFIG['max_size']
+        # pgbouncer事务池模式下预编译语句不能跨事务使用
+        self.pgbouncer = config.DB_POOL_CONFIG['pgbouncer']
+        self.acquire_count = 0
+        self.acquire_wait_total = 0.0
+        self.acquire_wait_max = 0.0
+
+    def configure(self, concurrency, process_count=1):
+        """
+        根据计划并发数和全局连接预算确定本进程的连接池大小，需在create_pool之前调用
+
+        :param concurrency: 本进程同时访问数据库的任务数
+        :param process_count: 共享连接预算的进程数
+        """
+        budget = max(1, config.DB_POOL_CONFIG['max_connections_budget'] // max(1, process_count))
+        # 额外的连接留给行情刷新、续约等后台任务
+        self.max_size = max(1, min(concurrency + 2, budget))
+        self.min_size = min(config.DB_CONFIG['min_size'], self.max_size)
+
+    def _connect_kwargs(self):
+        kwargs = {k: v for k, v in config.DB_CONFIG.items() if k not in ('min_size', 'max_size')}
+        if self.pgbouncer:
+            kwargs['statement_cache_size'] = 0
+        return kwargs
 
     async def create_pool(self):
-        """创建数据库连接池"""
+        """创建数据库连接池，同一事件循环内只创建一次"""
+        loop = asyncio.get_running_loop()
+        if self.pool is not None and self._loop is not loop:
+            # 连接池绑定在创建它的事件循环上，旧循环已结束时只能丢弃
+            self.pool = None
         if self.pool is None:
-            self.pool = await asyncpg.create_pool(**config.DB_CONFIG)
-            print("数据库连接池已创建")
+            self.pool = await asyncpg.create_pool(
+                min_size=self.min_size,
+                max_size=self.max_size,
+                connection_class=PreparedConnection,
+                **self._connect_kwargs()
+            )
+            self._loop = loop
+            print(f"数据库连接池已创建 (min_size={self.min_size}, max_size={self.max_size})")
         return self.pool
 
     async def close_pool(self):
@@ -22,7 +80,45 @@ class DatabaseManager:
         if self.pool:
             await self.pool.close()
             self.pool = None
-            print("数据库连接池已关闭")
+            self._loop = None
+            print(f"数据库连接池已关闭，{self.format_stats()}")
+
+    async def connect(self):
+        """创建单个直连连接，用于不需要连接池的一次性查询"""
+        return await asyncpg.connect(connection_class=PreparedConnection, **self._connect_kwargs())
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        """从连接池获取连接并记录等待时间"""
+        if self.pool is None:
+            await self.create_pool()
+        started = time.perf_counter()
+        async with self.pool.acquire() as conn:
+            wait = time.perf_counter() - started
+            self.acquire_count += 1
+            self.acquire_wait_total += wait
+            self.acquire_wait_max = max(self.acquire_wait_max, wait)
+            yield conn
+
+    def format_stats(self):
+        """连接获取等待时间统计"""
+        avg = self.acquire_wait_total / self.acquire_count if self.acquire_count else 0.0
+        return (f"获取连接 {self.acquire_count} 次，平均等待 {avg * 1000:.2f} ms，"
+                f"最长等待 {self.acquire_wait_max * 1000:.2f} ms")
+
+    async def fetchval(self, conn, query, *args):
+        """执行热点查询，非pgbouncer模式下复用显式预编译语句"""
+        if self.pgbouncer:
+            return await conn.fetchval(query, *args)
+        statement = await conn.prepared(query)
+        return await statement.fetchval(*args)
+
+    async def fetch(self, conn, query, *args):
+        """执行热点查询并返回全部记录，非pgbouncer模式下复用显式预编译语句"""
+        if self.pgbouncer:
+            return await conn.fetch(query, *args)
+        statement = await conn.prepared(query)
+        return await statement.fetch(*args)
 
     async def get_connection(self):
         """获取数据库连接"""
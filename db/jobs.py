@@ -0,0 +1,135 @@
+"""分布式下载任务队列"""
+from db.connection import db_manager
+
+
+async def enqueue_jobs(jobs, rerun=False):
+    """
+    批量写入下载任务，已存在的相同窗口会重新置为待执行，执行中的任务不受影响
+
+    :param jobs: [{'exchange_name', 'market_type', 'symbol', 'timeframe', 'dataset',
+                   'start_time', 'end_time', 'priority', 'weight'}, ...]，时间为毫秒时间戳
+    :param rerun: 已完成的任务是否也重新执行，默认保持完成状态
+    :return: 写入的任务数
+    """
+    if not jobs:
+        return 0
+
+    values = [
+        (j['exchange_name'], j['market_type'], j['symbol'], j['timeframe'], j.get('dataset', 'klines'),
+         int(j['start_time']), int(j['end_time']), j.get('priority', 0), float(j.get('weight', 0.0)), rerun)
+        for j in jobs
+    ]
+
+    async with db_manager.acquire() as conn:
+        query = """
+                INSERT INTO download_jobs
+                (exchange_name, market_type, symbol, timeframe, dataset, start_time, end_time, priority, weight)
+                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+                ON CONFLICT (exchange_name, market_type, symbol, timeframe, dataset, start_time, end_time) DO UPDATE
+                    SET priority   = EXCLUDED.priority,
+                        weight     = EXCLUDED.weight,
+                        status     = CASE
+                                         WHEN download_jobs.status = 'running'
+                                             OR (download_jobs.status = 'done' AND NOT $10::boolean)
+                                             THEN download_jobs.status
+                                         ELSE 'pending' END,
+                        attempts   = CASE
+                                         WHEN download_jobs.status = 'running'
+                                             OR (download_jobs.status = 'done' AND NOT $10::boolean)
+                                             THEN download_jobs.attempts
+                                         ELSE 0 END,
+                        updated_at = now() \
+                """
+        await conn.executemany(query, values)
+    return len(values)
+
+
+async def claim_jobs(worker_id, limit, lease_seconds, max_attempts, exchange_names=None):
+    """
+    领取待执行或租约已过期的任务
+
+    多个工作进程并发领取时通过 SKIP LOCKED 互不阻塞，也不会领到同一个任务；
+    工作进程在最后一次尝试中退出时不会调用fail_job，这类租约过期且尝试次数用完的任务先标记为失败
+    """
+    async with db_manager.acquire() as conn:
+        await conn.execute("""
+                           UPDATE download_jobs
+                           SET status        = 'failed',
+                               lease_owner   = NULL,
+                               lease_expires = NULL,
+                               last_error    = coalesce(last_error, '工作进程在执行中失联'),
+                               updated_at    = now()
+                           WHERE status = 'running'
+                             AND lease_expires < now()
+                             AND attempts >= $1 \
+                           """, max_attempts)
+
+        query = """
+                UPDATE download_jobs
+                SET status        = 'running',
+                    lease_owner   = $1,
+                    lease_expires = now() + make_interval(secs => $3),
+                    attempts      = attempts + 1,
+                    updated_at    = now()
+                WHERE job_id IN (SELECT job_id
+                                 FROM download_jobs
+                                 WHERE (status = 'pending' OR (status = 'running' AND lease_expires < now()))
+                                   AND attempts < $4
+                                   AND ($5::text[] IS NULL OR exchange_name = ANY ($5))
+                                 ORDER BY priority, weight DESC, end_time DESC
+                                 LIMIT $2 FOR UPDATE SKIP LOCKED)
+                RETURNING job_id, exchange_name, market_type, symbol, timeframe, dataset, start_time, end_time \
+                """
+        rows = await db_manager.fetch(conn, query, worker_id, limit, float(lease_seconds), max_attempts,
+                                      exchange_names)
+        return [dict(row) for row in rows]
+
+
+async def renew_leases(worker_id, job_ids, lease_seconds):
+    """为仍在执行的任务续约，返回续约成功的任务数"""
+    if not job_ids:
+        return 0
+
+    async with db_manager.acquire() as conn:
+        query = """
+                UPDATE download_jobs
+                SET lease_expires = now() + make_interval(secs => $3),
+                    updated_at    = now()
+                WHERE job_id = ANY ($2)
+                  AND lease_owner = $1
+                  AND status = 'running' \
+                """
+        status = await conn.execute(query, worker_id, list(job_ids), float(lease_seconds))
+        return int(status.split()[-1])
+
+
+async def complete_job(worker_id, job_id):
+    """标记任务完成"""
+    async with db_manager.acquire() as conn:
+        query = """
+                UPDATE download_jobs
+                SET status        = 'done',
+                    lease_owner   = NULL,
+                    lease_expires = NULL,
+                    last_error    = NULL,
+                    updated_at    = now()
+                WHERE job_id = $2
+                  AND lease_owner = $1 \
+                """
+        await conn.execute(query, worker_id, job_id)
+
+
+async def fail_job(worker_id, job_id, error, max_attempts):
+    """标记任务失败，未达到最大尝试次数时重新置为待执行"""
+    async with db_manager.acquire() as conn:
+        query = """
+                UPDATE download_jobs
+                SET status        = CASE WHEN attempts >= $4 THEN 'failed' ELSE 'pending' END,
+                    lease_owner   = NULL,
+                    lease_expires = NULL,
+                    last_error    = $3,
+                    updated_at    = now()
+                WHERE job_id = $2
+                  AND lease_owner = $1 \
+                """
+        await conn.execute(query, worker_id, job_id, error, max_attempts)
@@ -1,27 +1,40 @@
 """数据库模型和操作"""
-import datetime
-
 from db.connection import db_manager
+from utils.helpers import timeframe_to_ms
+from utils.profiling import profiler
+
+# 进程内ID缓存，交易所和交易对的ID创建后不会变化
+_exchange_ids = {}
+_pair_ids = {}
 
 
 async def get_exchange_id(exchange_name):
     """从数据库的exchange表查询exchange_id"""
-    async with db_manager.pool.acquire() as conn:
+    exchange_id = _exchange_ids.get(exchange_name)
+    if exchange_id is not None:
+        return exchange_id
+
+    async with db_manager.acquire() as conn:
         query = "SELECT exchange_id FROM exchanges WHERE exchange_name = $1"
-        exchange_id = await conn.fetchval(query, exchange_name)
+        exchange_id = await db_manager.fetchval(conn, query, exchange_name)
 
         if exchange_id is None:
             print(f"警告：未找到交易所 '{exchange_name}' 的ID")
             return None
 
+        _exchange_ids[exchange_name] = exchange_id
         return exchange_id
 
 
 async def get_pair_id(exchange_id, symbol, market_type, base_asset, quote_asset):
     """从数据库的trading_pairs表查询pair_id"""
-    async with db_manager.pool.acquire() as conn:
+    pair_id = _pair_ids.get((exchange_id, symbol))
+    if pair_id is not None:
+        return pair_id
+
+    async with db_manager.acquire() as conn:
         query = "SELECT pair_id FROM trading_pairs WHERE exchange_id = $1 AND symbol = $2"
-        pair_id = await conn.fetchval(query, exchange_id, symbol)
+        pair_id = await db_manager.fetchval(conn, query, exchange_id, symbol)
 
         if pair_id is None:
             print(f"警告：未找到交易对 '{symbol}' 的ID")
@@ -33,39 +46,318 @@ async def get_pair_id(exchange_id, symbol, market_type, base_asset, quote_asset)
             pair_id = await conn.fetchval(insert_query, exchange_id, symbol, market_type, base_asset, quote_asset)
             print(f"已创建新的交易对 '{symbol}'，ID为 {pair_id}")
 
+        _pair_ids[(exchange_id, symbol)] = pair_id
         return pair_id
 
 
+# K线暂存表的列，时间保持为毫秒时间戳，由数据库换算为timestamptz
+KLINE_STAGE_COLUMNS = (
+    'open_time', 'open', 'high', 'low', 'close', 'volume', 'quote_volume',
+    'trade_num', 'taker_buy_base_asset_volume', 'taker_buy_quote_asset_volume',
+)
+
+
+def normalize_klines(candles):
+    """
+    将交易所返回的K线转换为暂存表记录，不创建datetime对象
+
+    :return: [(open_time毫秒, open, high, low, close, volume, quote_volume, trade_num,
+              taker_buy_base_asset_volume, taker_buy_quote_asset_volume), ...]
+    """
+    return [
+        (int(c[0]), float(c[1]), float(c[2]), float(c[3]), float(c[4]), float(c[5]),
+         float(c[7]) if len(c) > 7 else 0.0,
+         int(c[8]) if len(c) > 8 else 0,
+         float(c[9]) if len(c) > 9 else 0.0,
+         float(c[10]) if len(c) > 10 else 0.0)
+        for c in candles
+    ]
+
+
+async def create_kline_stage(conn):
+    """创建K线暂存表kline_stage，列为 KLINE_STAGE_COLUMNS，事务提交时删除"""
+    await conn.execute("""
+                       CREATE TEMP TABLE kline_stage
+                       (
+                           open_time                    BIGINT,
+                           open                         DOUBLE PRECISION,
+                           high                         DOUBLE PRECISION,
+                           low                          DOUBLE PRECISION,
+                           close                        DOUBLE PRECISION,
+                           volume                       DOUBLE PRECISION,
+                           quote_volume                 DOUBLE PRECISION,
+                           trade_num                    BIGINT,
+                           taker_buy_base_asset_volume  DOUBLE PRECISION,
+                           taker_buy_quote_asset_volume DOUBLE PRECISION
+                       ) ON COMMIT DROP \
+                       """)
+
+
+async def copy_kline_records(conn, exchange_id, pair_id, timeframe, records):
+    """
+    通过二进制COPY写入K线记录，需在事务中调用
+
+    :param records: normalize_klines 返回的记录
+    :return: 实际新增的行数
+    """
+    await create_kline_stage(conn)
+    await conn.copy_records_to_table('kline_stage', records=records, columns=KLINE_STAGE_COLUMNS)
+    return await merge_kline_stage(conn, exchange_id, pair_id, timeframe)
+
+
+async def merge_kline_stage(conn, exchange_id, pair_id, timeframe):
+    """
+    将kline_stage中的K线写入kline_data并删除暂存表，需在事务中调用
+
+    close_time 为K线收盘时间(开盘时间 + 周期 - 1毫秒，与Binance的收盘时间一致)，按UTC写入；
+    尚未收盘的K线不写入，以免部分成交的数据以DO NOTHING固定下来；
+    同一条语句中按实际新增的行更新 kline_latest 的覆盖范围、行数和最新收盘价
+
+    :return: 实际新增的行数
+    """
+    query = """
+            WITH inserted AS (
+                INSERT INTO kline_data
+                (exchange_id, pair_id, timeframe, close_time, open, high, low, close,
+                 volume, quote_volume, trade_num, taker_buy_base_asset_volume, taker_buy_quote_asset_volume)
+                SELECT $1, $2, $3, timestamptz 'epoch' + (open_time + $4 - 1) * interval '1 millisecond',
+                       open, high, low, close, volume, quote_volume, trade_num,
+                       taker_buy_base_asset_volume, taker_buy_quote_asset_volume
+                FROM kline_stage
+                WHERE open_time + $4 - 1 < (extract(epoch FROM now()) * 1000)::bigint
+                ON CONFLICT (exchange_id, pair_id, timeframe, close_time) DO NOTHING
+                RETURNING close_time, close),
+                 summary AS (
+                     SELECT count(*)                                      AS row_count,
+                            min(close_time)                               AS first_close_time,
+                            max(close_time)                               AS last_close_time,
+                            (array_agg(close ORDER BY close_time DESC))[1] AS last_close
+                     FROM inserted),
+                 latest AS (
+                     INSERT INTO kline_latest
+                     (exchange_id, pair_id, timeframe, first_close_time, last_close_time, row_count, last_close)
+                     SELECT $1, $2, $3, first_close_time, last_close_time, row_count, last_close
+                     FROM summary
+                     WHERE row_count > 0
+                     ON CONFLICT (exchange_id, pair_id, timeframe) DO UPDATE
+                         SET first_close_time = least(kline_latest.first_close_time, EXCLUDED.first_close_time),
+                             last_close_time  = greatest(kline_latest.last_close_time, EXCLUDED.last_close_time),
+                             row_count        = kline_latest.row_count + EXCLUDED.row_count,
+                             last_close       = CASE
+                                                    WHEN EXCLUDED.last_close_time >= kline_latest.last_close_time
+                                                        THEN EXCLUDED.last_close
+                                                    ELSE kline_latest.last_close END,
+                             updated_at       = now())
+            SELECT row_count FROM summary \
+            """
+    inserted = await db_manager.fetchval(conn, query, exchange_id, pair_id, timeframe, timeframe_to_ms(timeframe))
+    # 同一事务内可多次调用
+    await conn.execute("DROP TABLE kline_stage")
+    return inserted
+
+
+async def rebuild_kline_latest(conn, exchange_id=None):
+    """
+    按kline_data全量重建kline_latest，用于首次建表或手工修改K线之后
+
+    :param exchange_id: 只重建指定交易所，None表示全部
+    :return: 重建的序列数
+    """
+    await conn.execute("DELETE FROM kline_latest WHERE $1::integer IS NULL OR exchange_id = $1", exchange_id)
+    query = """
+            INSERT INTO kline_latest
+            (exchange_id, pair_id, timeframe, first_close_time, last_close_time, row_count, last_close)
+            SELECT exchange_id,
+                   pair_id,
+                   timeframe,
+                   min(close_time),
+                   max(close_time),
+                   count(*),
+                   (array_agg(close ORDER BY close_time DESC))[1]
+            FROM kline_data
+            WHERE $1::integer IS NULL OR exchange_id = $1
+            GROUP BY exchange_id, pair_id, timeframe \
+            """
+    status = await conn.execute(query, exchange_id)
+    return int(status.split()[-1])
+
+
 async def insert_kline_data(exchange_id, pair_id, timeframe, candles):
     """批量插入K线数据"""
     if not candles:
         return 0
 
-    values = []
-    for candle in candles:
-        close_time = datetime.datetime.fromtimestamp(int(candle[0]) / 1000)
-        values.append((
-            exchange_id, pair_id, timeframe, close_time,
-            float(candle[1]), float(candle[2]), float(candle[3]), float(candle[4]),
-            float(candle[5]), float(candle[7]) if len(candle) > 7 else 0,
-            int(candle[8]) if len(candle) > 8 else 0,
-            float(candle[9]) if len(candle) > 9 else 0,
-            float(candle[10]) if len(candle) > 10 else 0
-        ))
-
-    async with db_manager.pool.acquire() as conn:
+    with profiler.stage('normalize'):
+        records = normalize_klines(candles)
+
+    async with db_manager.acquire() as conn:
+        try:
+            with profiler.stage('write'):
+                async with conn.transaction():
+                    return await copy_kline_records(conn, exchange_id, pair_id, timeframe, records)
+        except Exception as e:
+            print(f"插入数据时发生错误: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            raise
+
+
+async def record_kline_gaps(exchange_id, pair_id, timeframe, start_time, end_time):
+    """
+    记录窗口内交易所确认缺失的K线
+
+    在窗口成功下载并写入之后调用，只检查已入库覆盖范围(首尾K线之间)内的K线，
+    仍然不存在的即为交易所的真实缺口，写入 kline_gaps
+
+    :param start_time: 窗口开始时间(毫秒)
+    :param end_time: 窗口结束时间(毫秒)
+    :return: 新记录的缺失K线根数
+    """
+    query = """
+            WITH bounds AS (
+                SELECT (extract(epoch FROM first_close_time) * 1000)::bigint AS first_close,
+                       (extract(epoch FROM last_close_time) * 1000)::bigint  AS last_close
+                FROM kline_latest
+                WHERE exchange_id = $1
+                  AND pair_id = $2
+                  AND timeframe = $3),
+                 expected AS (
+                     -- 按首根K线对齐到周期网格
+                     SELECT timestamptz 'epoch' + t * interval '1 millisecond' AS close_time
+                     FROM bounds,
+                          generate_series(
+                                  first_close + greatest(0, ($5::bigint + 2 * ($4::bigint - 1) - first_close) / $4) * $4,
+                                  least(last_close, $6::bigint + $4 - 1),
+                                  $4::bigint) AS t)
+            INSERT INTO kline_gaps (exchange_id, pair_id, timeframe, close_time)
+            SELECT $1, $2, $3, e.close_time
+            FROM expected e
+            WHERE NOT EXISTS (SELECT 1
+                              FROM kline_data kd
+                              WHERE kd.exchange_id = $1
+                                AND kd.pair_id = $2
+                                AND kd.timeframe = $3
+                                AND kd.close_time = e.close_time)
+            ON CONFLICT DO NOTHING \
+            """
+    async with db_manager.acquire() as conn:
+        status = await conn.execute(query, exchange_id, pair_id, timeframe, timeframe_to_ms(timeframe),
+                                    start_time, end_time)
+    return int(status.split()[-1])
+
+
+# 非K线数据集的表结构: 表名、时间列、数值列，with_timeframe为True时按周期区分，
+# close_time为True时时间列为收盘时间(开始时间 + 周期 - 1毫秒)
+DATASET_TABLES = {
+    'funding_rate': {
+        'table': 'funding_rates', 'time_column': 'funding_time', 'columns': ('funding_rate',),
+        'with_timeframe': False, 'close_time': False,
+    },
+    'open_interest': {
+        'table': 'open_interest', 'time_column': 'ts', 'columns': ('open_interest', 'open_interest_value'),
+        'with_timeframe': True, 'close_time': False,
+    },
+    'mark_price': {
+        'table': 'mark_price_klines', 'time_column': 'close_time', 'columns': ('open', 'high', 'low', 'close'),
+        'with_timeframe': True, 'close_time': True,
+    },
+}
+
+
+async def copy_dataset_records(conn, dataset, exchange_id, pair_id, timeframe, records):
+    """
+    通过二进制COPY写入非K线数据集，需在事务中调用，尚未收盘的标记价格K线不写入
+
+    :param records: 交易所 fetch_<dataset> 返回的记录，首列为毫秒时间戳
+    :return: 实际新增的行数
+    """
+    spec = DATASET_TABLES[dataset]
+    columns = spec['columns']
+    column_defs = ', '.join(f"{column} DOUBLE PRECISION" for column in columns)
+    await conn.execute(f"CREATE TEMP TABLE dataset_stage (ts BIGINT, {column_defs}) ON COMMIT DROP")
+    await conn.copy_records_to_table('dataset_stage', records=records, columns=('ts',) + columns)
+
+    key_columns = ['exchange_id', 'pair_id']
+    key_values = ['$1', '$2']
+    args = [exchange_id, pair_id, timeframe_to_ms(timeframe) - 1 if spec['close_time'] else 0]
+    if spec['with_timeframe']:
+        key_columns.append('timeframe')
+        key_values.append('$4')
+        args.append(timeframe)
+
+    value_list = ', '.join(columns)
+    query = f"""
+            INSERT INTO {spec['table']}
+            ({', '.join(key_columns)}, {spec['time_column']}, {value_list})
+            SELECT {', '.join(key_values)}, timestamptz 'epoch' + (ts + $3) * interval '1 millisecond', {value_list}
+            FROM dataset_stage
+            WHERE ts + $3 < (extract(epoch FROM now()) * 1000)::bigint
+            ON CONFLICT ({', '.join(key_columns)}, {spec['time_column']}) DO NOTHING \
+            """
+    status = await conn.execute(query, *args)
+    # 同一事务内可多次调用
+    await conn.execute("DROP TABLE dataset_stage")
+    return int(status.split()[-1])
+
+
+async def insert_dataset_records(dataset, exchange_id, pair_id, timeframe, records):
+    """批量插入资金费率、持仓量或标记价格K线"""
+    if not records:
+        return 0
+
+    async with db_manager.acquire() as conn:
+        try:
+            with profiler.stage('write'):
+                async with conn.transaction():
+                    return await copy_dataset_records(conn, dataset, exchange_id, pair_id, timeframe, records)
+        except Exception as e:
+            print(f"插入{dataset}数据时发生错误: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            raise
+
+
+async def upsert_ticker_snapshots(exchange_id, market_type, snapshots):
+    """
+    批量更新行情快照
+
+    :param snapshots: [(pair_id, ticker), ...]，ticker为交易所适配器返回的标准化字典
+    """
+    if not snapshots:
+        return 0
+
+    values = [
+        (exchange_id, pair_id, market_type,
+         int(t['open_time']), int(t['close_time']),
+         t['open'], t['high'], t['low'], t['close'],
+         t['volume'], t['quote_volume'], t['trade_num'])
+        for pair_id, t in snapshots
+    ]
+
+    async with db_manager.acquire() as conn:
         try:
             query = """
-                    INSERT INTO kline_data
-                    (exchange_id, pair_id, timeframe, close_time, open, high, low, close,
-                     volume, quote_volume, trade_num, taker_buy_base_asset_volume, taker_buy_quote_asset_volume)
-                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12,
-                            $13) ON CONFLICT (exchange_id, pair_id, timeframe, close_time) DO NOTHING \
+                    INSERT INTO ticker_snapshots
+                    (exchange_id, pair_id, market_type, open_time, close_time, open, high, low, close,
+                     volume, quote_volume, trade_num, updated_at)
+                    VALUES ($1, $2, $3, to_timestamp($4::bigint / 1000.0), to_timestamp($5::bigint / 1000.0),
+                            $6, $7, $8, $9, $10, $11, $12, now())
+                    ON CONFLICT (exchange_id, pair_id, market_type) DO UPDATE
+                        SET open_time    = EXCLUDED.open_time,
+                            close_time   = EXCLUDED.close_time,
+                            open         = EXCLUDED.open,
+                            high         = EXCLUDED.high,
+                            low          = EXCLUDED.low,
+                            close        = EXCLUDED.close,
+                            volume       = EXCLUDED.volume,
+                            quote_volume = EXCLUDED.quote_volume,
+                            trade_num    = EXCLUDED.trade_num,
+                            updated_at   = EXCLUDED.updated_at \
                     """
             await conn.executemany(query, values)
             return len(values)
         except Exception as e:
-            print(f"插入数据时发生错误: {str(e)}")
+            print(f"更新行情快照时发生错误: {str(e)}")
             import traceback
             traceback.print_exc()
             return 0
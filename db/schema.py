@@ -0,0 +1,144 @@
+"""数据库表结构"""
+from db.connection import db_manager
+
+# 各交易对最新的24小时滚动行情快照，由批量ticker接口刷新
+TICKER_SNAPSHOTS = """
+    CREATE TABLE IF NOT EXISTS ticker_snapshots
+    (
+        exchange_id  INTEGER     NOT NULL,
+        pair_id      INTEGER     NOT NULL,
+        market_type  VARCHAR(16) NOT NULL,
+        open_time    TIMESTAMPTZ NOT NULL,
+        close_time   TIMESTAMPTZ NOT NULL,
+        open         DOUBLE PRECISION,
+        high         DOUBLE PRECISION,
+        low          DOUBLE PRECISION,
+        close        DOUBLE PRECISION,
+        volume       DOUBLE PRECISION,
+        quote_volume DOUBLE PRECISION,
+        trade_num    BIGINT,
+        updated_at   TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (exchange_id, pair_id, market_type)
+    )
+"""
+
+# 每个序列(交易所、交易对、周期)的覆盖范围和最新K线，与K线写入在同一事务中增量维护
+KLINE_LATEST = """
+    CREATE TABLE IF NOT EXISTS kline_latest
+    (
+        exchange_id      INTEGER     NOT NULL,
+        pair_id          INTEGER     NOT NULL,
+        timeframe        VARCHAR(8)  NOT NULL,
+        first_close_time TIMESTAMPTZ NOT NULL,
+        last_close_time  TIMESTAMPTZ NOT NULL,
+        row_count        BIGINT      NOT NULL,
+        last_close       DOUBLE PRECISION,
+        updated_at       TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (exchange_id, pair_id, timeframe)
+    )
+"""
+
+# 交易所确认缺失的K线(停机、停牌等)，重新下载后仍然缺失的每根K线一行，
+# 计算覆盖范围时计入行数，避免有真实缺口的序列被反复重新下载
+KLINE_GAPS = """
+    CREATE TABLE IF NOT EXISTS kline_gaps
+    (
+        exchange_id INTEGER     NOT NULL,
+        pair_id     INTEGER     NOT NULL,
+        timeframe   VARCHAR(8)  NOT NULL,
+        close_time  TIMESTAMPTZ NOT NULL,
+        checked_at  TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (exchange_id, pair_id, timeframe, close_time)
+    )
+"""
+
+# 永续合约资金费率
+FUNDING_RATES = """
+    CREATE TABLE IF NOT EXISTS funding_rates
+    (
+        exchange_id  INTEGER          NOT NULL,
+        pair_id      INTEGER          NOT NULL,
+        funding_time TIMESTAMPTZ      NOT NULL,
+        funding_rate DOUBLE PRECISION NOT NULL,
+        PRIMARY KEY (exchange_id, pair_id, funding_time)
+    )
+"""
+
+# 永续合约持仓量，open_interest单位为币，open_interest_value单位为USDT(部分交易所不提供)
+OPEN_INTEREST = """
+    CREATE TABLE IF NOT EXISTS open_interest
+    (
+        exchange_id         INTEGER     NOT NULL,
+        pair_id             INTEGER     NOT NULL,
+        timeframe           VARCHAR(8)  NOT NULL,
+        ts                  TIMESTAMPTZ NOT NULL,
+        open_interest       DOUBLE PRECISION,
+        open_interest_value DOUBLE PRECISION,
+        PRIMARY KEY (exchange_id, pair_id, timeframe, ts)
+    )
+"""
+
+# 永续合约标记价格K线，close_time与kline_data一致为收盘时间
+MARK_PRICE_KLINES = """
+    CREATE TABLE IF NOT EXISTS mark_price_klines
+    (
+        exchange_id INTEGER     NOT NULL,
+        pair_id     INTEGER     NOT NULL,
+        timeframe   VARCHAR(8)  NOT NULL,
+        close_time  TIMESTAMPTZ NOT NULL,
+        open        DOUBLE PRECISION,
+        high        DOUBLE PRECISION,
+        low         DOUBLE PRECISION,
+        close       DOUBLE PRECISION,
+        PRIMARY KEY (exchange_id, pair_id, timeframe, close_time)
+    )
+"""
+
+# 分布式下载任务队列，工作进程通过 FOR UPDATE SKIP LOCKED 领取任务并按租约续期
+DOWNLOAD_JOBS = """
+    CREATE TABLE IF NOT EXISTS download_jobs
+    (
+        job_id        BIGSERIAL PRIMARY KEY,
+        exchange_name VARCHAR(32) NOT NULL,
+        market_type   VARCHAR(16) NOT NULL,
+        symbol        VARCHAR(64) NOT NULL,
+        timeframe     VARCHAR(8)  NOT NULL,
+        dataset       VARCHAR(32) NOT NULL DEFAULT 'klines',
+        start_time    BIGINT      NOT NULL,
+        end_time      BIGINT      NOT NULL,
+        priority      SMALLINT    NOT NULL DEFAULT 0,
+        weight        DOUBLE PRECISION NOT NULL DEFAULT 0,
+        status        VARCHAR(16) NOT NULL DEFAULT 'pending',
+        attempts      INTEGER     NOT NULL DEFAULT 0,
+        lease_owner   TEXT,
+        lease_expires TIMESTAMPTZ,
+        last_error    TEXT,
+        created_at    TIMESTAMPTZ NOT NULL DEFAULT now(),
+        updated_at    TIMESTAMPTZ NOT NULL DEFAULT now(),
+        UNIQUE (exchange_name, market_type, symbol, timeframe, dataset, start_time, end_time)
+    )
+"""
+
+DOWNLOAD_JOBS_INDEX = """
+    CREATE INDEX IF NOT EXISTS download_jobs_claim_idx
+        ON download_jobs (priority, weight DESC, end_time DESC)
+        WHERE status IN ('pending', 'running')
+"""
+
+TABLES = [
+    TICKER_SNAPSHOTS,
+    KLINE_LATEST,
+    KLINE_GAPS,
+    FUNDING_RATES,
+    OPEN_INTEREST,
+    MARK_PRICE_KLINES,
+    DOWNLOAD_JOBS,
+    DOWNLOAD_JOBS_INDEX,
+]
+
+
+async def ensure_schema():
+    """创建程序依赖的辅助表(已存在则跳过)"""
+    async with db_manager.acquire() as conn:
+        for ddl in TABLES:
+            await conn.execute(ddl)
@@ -1,19 +1,32 @@
 """交易所模块"""
-from exchanges.binance import BinanceExchange
-from exchanges.bybit import BybitExchange
-from exchanges.okex import OKExExchange
+import importlib
+
+# 交易所名称 -> (模块, 类名)，首次使用时才导入对应模块及其HTTP依赖
+EXCHANGES = {
+    'binance': ('exchanges.binance', 'BinanceExchange'),
+    'okex': ('exchanges.okex', 'OKExExchange'),
+    'bybit': ('exchanges.bybit', 'BybitExchange'),
+}
+
+
+def get_exchange_class(name):
+    """获取交易所类"""
+    entry = EXCHANGES.get(name.lower())
+    if not entry:
+        raise ValueError(f"不支持的交易所: {name}")
+
+    module_name, class_name = entry
+    return getattr(importlib.import_module(module_name), class_name)
 
 
 def get_exchange(name):
     """获取交易所实例"""
-    exchanges = {
-        'binance': BinanceExchange,
-        'okex': OKExExchange,
-        'bybit': BybitExchange,
-    }
-
-    exchange_class = exchanges.get(name.lower())
-    if not exchange_class:
-        raise ValueError(f"不支持的交易所: {name}")
+    return get_exchange_class(name)()
+
 
-    return exchange_class()
+def __getattr__(name):
+    """兼容 from exchanges import BinanceExchange 的写法"""
+    for module_name, class_name in EXCHANGES.values():
+        if class_name == name:
+            return getattr(importlib.import_module(module_name), class_name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
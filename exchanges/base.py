@@ -1,17 +1,77 @@
 """交易所基类"""
-import datetime
+import asyncio
+import time
 from abc import ABC, abstractmethod
 from typing import List, Dict
 
 from db import models
 from utils import logger
+from utils.helpers import timeframe_to_ms, to_ms
+from utils.rate_limit import get_rate_limiter
+from utils.retry import RetryPolicy
+
+# 可下载的数据集，klines之外的数据集只有永续合约
+DATASETS = ('klines', 'funding_rate', 'open_interest', 'mark_price')
+
+# 资金费率按1h网格对齐窗口，窗口跨度按结算间隔(interval_hours)确定
+FUNDING_RATE_TIMEFRAME = '1h'
+
+
+def dataset_timeframes(dataset, timeframes):
+    """数据集实际下载的周期，资金费率与周期无关"""
+    return [FUNDING_RATE_TIMEFRAME] if dataset == 'funding_rate' else list(timeframes)
+
+
+def get_window_spec(exchange_config, dataset, market_type, timeframe):
+    """
+    数据集的分页参数
+
+    :return: (每个窗口的条数, 单次请求的权重)，交易所或周期不支持时返回None
+    """
+    if dataset == 'klines':
+        return exchange_config['kline_limit'], exchange_config['kline_weight'][market_type]
+
+    spec = exchange_config.get('datasets', {}).get(dataset)
+    if spec is None or market_type != 'futures':
+        return None
+    if 'timeframe_map' in spec and timeframe not in spec['timeframe_map']:
+        return None
+    bars_per_window = spec['limit']
+    if 'interval_hours' in spec:
+        # 每个窗口容纳limit次结算，结算更频繁的合约由交易所实现继续分页
+        bars_per_window = spec['limit'] * spec['interval_hours'] * 3600 * 1000 // timeframe_to_ms(timeframe)
+    return bars_per_window, spec['weight']
+
+
+def dataset_start_time(exchange_config, dataset, start_ts, now_ms=None):
+    """
+    数据集实际可下载的起始时间(毫秒)
+
+    交易所只保留最近retention_days天的数据集，更早的窗口请求不到数据，从保留期开始下载
+    """
+    spec = exchange_config.get('datasets', {}).get(dataset) or {}
+    if 'retention_days' not in spec:
+        return start_ts
+    if now_ms is None:
+        now_ms = int(time.time() * 1000)
+    return max(start_ts, now_ms - spec['retention_days'] * 24 * 60 * 60 * 1000)
+
+
+class DownloadError(Exception):
+    """数据获取失败(重试用尽、接口返回错误等)，与窗口内确实没有数据相区分"""
 
 
 class BaseExchange(ABC):
     """交易所基类"""
 
+    # fetch_klines是否确定返回[start_time, end_time]内的全部K线(两端都包含)，
+    # 只有确定时才把下载后仍缺失的K线记为交易所缺口
+    KLINE_WINDOW_INCLUSIVE = False
+
     def __init__(self, name):
         self.name = name
+        self.rate_limiter = get_rate_limiter(name)
+        self.retry_policy = RetryPolicy()
 
     @abstractmethod
     async def fetch_klines(self, symbol, timeframe, start_time, end_time, market_type):
@@ -21,38 +81,106 @@ class BaseExchange(ABC):
     async def get_symbols(self) -> Dict[str, List[str]]:
         pass
 
-    async def download_data(self, symbol, timeframe, start_time, end_time, market_type='spot'):
-        """下载并保存数据到数据库"""
-        logger.info(f"下载 {self.name} {market_type} {symbol} 数据...")
+    def fetch_funding_rate(self, symbol, timeframe, start_time, end_time) -> List[tuple]:
+        """获取永续合约资金费率，返回 [(结算时间毫秒, 资金费率), ...]"""
+        raise NotImplementedError(f"{self.name} 不支持资金费率")
 
-        # 确保使用UTC时间
-        if not start_time.tzinfo:
-            start_time = start_time.replace(tzinfo=datetime.timezone.utc)
-        if not end_time.tzinfo:
-            end_time = end_time.replace(tzinfo=datetime.timezone.utc)
+    def fetch_open_interest(self, symbol, timeframe, start_time, end_time) -> List[tuple]:
+        """获取永续合约持仓量，返回 [(时间毫秒, 持仓量(币), 持仓价值(USDT)或None), ...]"""
+        raise NotImplementedError(f"{self.name} 不支持持仓量")
 
-        # 转换为毫秒时间戳
-        start_ts = int(start_time.timestamp() * 1000)
-        end_ts = int(end_time.timestamp() * 1000)
+    def fetch_mark_price(self, symbol, timeframe, start_time, end_time) -> List[tuple]:
+        """获取永续合约标记价格K线，返回 [(开盘时间毫秒, open, high, low, close), ...]"""
+        raise NotImplementedError(f"{self.name} 不支持标记价格K线")
 
-        # 获取数据
-        data = self.fetch_klines(symbol, timeframe, start_ts, end_ts, market_type)
+    def fetch_dataset(self, dataset, symbol, timeframe, start_time, end_time, market_type):
+        """按数据集获取一个时间窗口的数据"""
+        if dataset == 'klines':
+            return self.fetch_klines(symbol, timeframe, start_time, end_time, market_type)
+        if dataset not in DATASETS:
+            raise ValueError(f"不支持的数据集: {dataset}")
+        return getattr(self, f"fetch_{dataset}")(symbol, timeframe, start_time, end_time)
 
-        if data:
-            # 获取exchange_id和pair_id
-            exchange_id = await models.get_exchange_id(self.name)
-            if not exchange_id:
-                logger.error(f"无法获取交易所ID: {self.name}")
-                return
+    def fetch_tickers(self, market_type) -> List[Dict]:
+        """
+        批量获取全部USDT交易对的24小时滚动行情
+
+        每个元素为标准化字典: symbol(如 'BTC/USDT'), open_time, close_time(毫秒),
+        open, high, low, close, volume, quote_volume, trade_num
+        """
+        raise NotImplementedError(f"{self.name} 不支持批量行情接口")
+
+    async def refresh_latest_bars(self, market_type='spot', tickers=None):
+        """
+        通过批量行情接口刷新全部交易对的最新行情快照
+
+        :param tickers: 已获取的 fetch_tickers 结果，为None时在线程中请求
+        """
+        if tickers is None:
+            tickers = await asyncio.to_thread(self.fetch_tickers, market_type)
+        if not tickers:
+            logger.warning(f"没有获取到 {self.name} {market_type} 的批量行情")
+            return 0
 
+        exchange_id = await models.get_exchange_id(self.name)
+        if not exchange_id:
+            logger.error(f"无法获取交易所ID: {self.name}")
+            return 0
+
+        snapshots = []
+        for ticker in tickers:
+            symbol = ticker['symbol']
             base_asset, quote_asset = symbol.split('/')
             pair_id = await models.get_pair_id(exchange_id, symbol, market_type, base_asset, quote_asset)
-            if not pair_id:
-                logger.error(f"无法获取交易对ID: {symbol}")
+            if pair_id:
+                snapshots.append((pair_id, ticker))
+
+        updated_count = await models.upsert_ticker_snapshots(exchange_id, market_type, snapshots)
+        logger.info(f"{self.name} {market_type} 已刷新 {updated_count} 个交易对的最新行情")
+        return updated_count
+
+    async def download_data(self, symbol, timeframe, start_time, end_time, market_type='spot', dataset='klines'):
+        """
+        下载并保存数据到数据库
+
+        获取或写入失败时抛出异常(DownloadError或数据库错误)，正常返回表示窗口已完整写入
+        """
+        logger.info(f"下载 {self.name} {market_type} {symbol} {dataset} 数据...")
+
+        # 转换为毫秒时间戳(已是毫秒时间戳的窗口直接使用)
+        start_ts = to_ms(start_time)
+        end_ts = to_ms(end_time)
+
+        # 获取数据，HTTP请求在线程中执行以免阻塞其他任务
+        data = await asyncio.to_thread(self.fetch_dataset, dataset, symbol, timeframe, start_ts, end_ts, market_type)
+
+        if not data:
+            logger.warning(f"没有获取到 {self.name} {market_type} {symbol} 的{dataset}数据")
+            # 整个窗口都落在缺口中时也需要记录缺口
+            if dataset != 'klines':
                 return
 
-            # 插入数据
-            inserted_count = await models.insert_kline_data(exchange_id, pair_id, timeframe, data)
+        # 获取exchange_id和pair_id
+        exchange_id = await models.get_exchange_id(self.name)
+        if not exchange_id:
+            raise DownloadError(f"无法获取交易所ID: {self.name}")
+
+        base_asset, quote_asset = symbol.split('/')
+        pair_id = await models.get_pair_id(exchange_id, symbol, market_type, base_asset, quote_asset)
+        if not pair_id:
+            raise DownloadError(f"无法获取交易对ID: {symbol}")
+
+        # 插入数据
+        if data:
+            if dataset == 'klines':
+                inserted_count = await models.insert_kline_data(exchange_id, pair_id, timeframe, data)
+            else:
+                inserted_count = await models.insert_dataset_records(dataset, exchange_id, pair_id, timeframe, data)
             logger.info(f"成功插入 {inserted_count} 条数据到数据库")
-        else:
-            logger.warning(f"没有获取到 {self.name} {market_type} {symbol} 的数据")
+
+        # 返回的K线少于窗口内的根数时，下载成功后仍缺失的K线是交易所的真实缺口
+        if (dataset == 'klines' and self.KLINE_WINDOW_INCLUSIVE
+                and len(data) < (end_ts - start_ts) // timeframe_to_ms(timeframe) + 1):
+            gap_count = await models.record_kline_gaps(exchange_id, pair_id, timeframe, start_ts, end_ts)
+            if gap_count:
+                logger.info(f"{self.name} {market_type} {symbol} {timeframe} 记录 {gap_count} 根交易所缺失的K线")
@@ -4,13 +4,25 @@ from typing import Dict, List, Optional, Any
 import requests
 
 from conf.config import EXCHANGE_CONFIG
-from exchanges.base import BaseExchange
+from exchanges.base import BaseExchange, DownloadError
 from utils import logger
+from utils.helpers import is_window_closed
+from utils.http_cache import http_cache
+from utils.profiling import profiler
+from utils.retry import RETRYABLE_KINDS, RetryableError, classify_response, get_circuit_breaker, parse_retry_after
 
 
 class BinanceExchange(BaseExchange):
     """Binance交易所"""
 
+    # fetch_klines返回[start_time, end_time]内的全部K线(两端都包含)
+    KLINE_WINDOW_INCLUSIVE = True
+
+    # 限频错误码
+    RATE_LIMIT_CODES = (-1003, -1015)
+    # 服务端内部错误/超时错误码
+    SERVER_ERROR_CODES = (-1000, -1001, -1006, -1007)
+
     def __init__(self):
         super().__init__('binance')
         self.config = EXCHANGE_CONFIG['binance']
@@ -18,6 +30,34 @@ class BinanceExchange(BaseExchange):
         self.futures_endpoint = self.config['futures_endpoint']
         self.session = requests.Session()
 
+    def _request_once(self, url: str, params: Optional[Dict[str, Any]], immutable: bool, weight: int) -> Any:
+        """发送一次HTTP请求，可重试的错误以RetryableError抛出"""
+        response = http_cache.get(self.session, url, params=params, timeout=10,
+                                  immutable=immutable,
+                                  limiter=self.rate_limiter, weight=weight)
+
+        if response.status_code != 200:
+            try:
+                error_code = response.json().get('code')
+            except ValueError:
+                error_code = None
+            kind = classify_response(response.status_code, error_code,
+                                     self.RATE_LIMIT_CODES, self.SERVER_ERROR_CODES)
+            if kind in RETRYABLE_KINDS:
+                raise RetryableError(kind, f"HTTP {response.status_code}, 错误码: {error_code}",
+                                     parse_retry_after(response.headers))
+            response.raise_for_status()
+
+        with profiler.stage('decode'):
+            return response.json()
+
+    def _make_request(self, url: str, params: Optional[Dict[str, Any]] = None, immutable: bool = False,
+                      weight: int = 1) -> Any:
+        """发送API请求，可重试的错误按统一策略重试，失败时抛出异常"""
+        # 418(IP被封禁)和429会按Retry-After打开该endpoint的熔断器
+        return self.retry_policy.call(self._request_once, url, params, immutable, weight,
+                                      breaker=get_circuit_breaker(f"binance:{url}"))
+
     def fetch_klines(self, symbol: str, timeframe: str, start_time: int, end_time: int, market_type: str) -> List:
         """获取Binance K线数据"""
         try:
@@ -36,15 +76,16 @@ class BinanceExchange(BaseExchange):
                 'interval': tf,
                 'startTime': start_time,
                 'endTime': end_time,
-                'limit': 1000
+                'limit': self.config['kline_limit']
             }
 
             logger.info(f"请求URL: {endpoint}")
             logger.info(f"请求参数: {params}")
 
-            response = self.session.get(endpoint, params=params)
-            response.raise_for_status()
-            data = response.json()
+            # 已收盘的历史窗口响应不可变，可持久化缓存
+            data = self._make_request(endpoint, params,
+                                      immutable=is_window_closed(end_time, timeframe),
+                                      weight=self.config['kline_weight'][market_type])
 
             if data:
                 logger.info(f"获取到 {len(data)} 条 Binance {market_type} {symbol} 数据")
@@ -58,7 +99,98 @@ class BinanceExchange(BaseExchange):
             logger.error(f"获取Binance数据时发生错误: {str(e)}")
             import traceback
             logger.error(traceback.format_exc())
-            return []
+            raise DownloadError(f"获取Binance {market_type} {symbol} 数据失败: {str(e)}") from e
+
+    def _fetch_dataset_window(self, dataset: str, params: Dict[str, Any], timeframe: str, end_time: int) -> List:
+        """请求数据集的一个窗口，窗口内的条数不超过limit，一次即可取完"""
+        spec = self.config['datasets'][dataset]
+        try:
+            data = self._make_request(spec['endpoint'], {**params, 'limit': spec['limit']},
+                                      immutable=is_window_closed(end_time, timeframe),
+                                      weight=spec['weight'])
+            logger.info(f"获取到 {len(data)} 条 Binance {params['symbol']} {dataset} 数据")
+            return data
+        except Exception as e:
+            logger.error(f"获取Binance {dataset} 数据时发生错误: {str(e)}")
+            import traceback
+            logger.error(traceback.format_exc())
+            raise DownloadError(f"获取Binance {params['symbol']} {dataset} 数据失败: {str(e)}") from e
+
+    def fetch_funding_rate(self, symbol: str, timeframe: str, start_time: int, end_time: int) -> List[tuple]:
+        """
+        获取Binance永续合约资金费率
+
+        窗口按8小时结算间隔确定，结算更频繁的合约单次返回满limit条时从最后一条之后继续请求
+        """
+        limit = self.config['datasets']['funding_rate']['limit']
+        result = []
+        current_start = start_time
+        while current_start <= end_time:
+            params = {'symbol': symbol.replace('/', ''), 'startTime': current_start, 'endTime': end_time}
+            # 按结算时间正序返回
+            data = self._fetch_dataset_window('funding_rate', params, timeframe, end_time)
+            result.extend((int(d['fundingTime']), float(d['fundingRate'])) for d in data)
+            if len(data) < limit:
+                break
+            current_start = int(data[-1]['fundingTime']) + 1
+        return result
+
+    def fetch_open_interest(self, symbol: str, timeframe: str, start_time: int, end_time: int) -> List[tuple]:
+        """获取Binance永续合约持仓量历史"""
+        params = {
+            'symbol': symbol.replace('/', ''),
+            'period': self.config['datasets']['open_interest']['timeframe_map'][timeframe],
+            'startTime': start_time,
+            'endTime': end_time,
+        }
+        data = self._fetch_dataset_window('open_interest', params, timeframe, end_time)
+        return [(int(d['timestamp']), float(d['sumOpenInterest']), float(d['sumOpenInterestValue'])) for d in data]
+
+    def fetch_mark_price(self, symbol: str, timeframe: str, start_time: int, end_time: int) -> List[tuple]:
+        """获取Binance永续合约标记价格K线"""
+        params = {
+            'symbol': symbol.replace('/', ''),
+            'interval': self.config['timeframe_map'][timeframe],
+            'startTime': start_time,
+            'endTime': end_time,
+        }
+        data = self._fetch_dataset_window('mark_price', params, timeframe, end_time)
+        return [(int(c[0]), float(c[1]), float(c[2]), float(c[3]), float(c[4])) for c in data]
+
+    def fetch_tickers(self, market_type: str) -> List[Dict]:
+        """批量获取 Binance USDT 交易对的24小时行情，每个市场一次请求"""
+        endpoint = (self.config['spot_ticker_endpoint'] if market_type == 'spot'
+                    else self.config['futures_ticker_endpoint'])
+        result = []
+
+        try:
+            tickers = self._make_request(endpoint, weight=self.config['ticker_weight'][market_type])
+
+            for ticker in tickers:
+                symbol = ticker['symbol']
+                if not symbol.endswith('USDT'):
+                    continue
+                result.append({
+                    'symbol': f"{symbol[:-4]}/USDT",
+                    'open_time': int(ticker['openTime']),
+                    'close_time': int(ticker['closeTime']),
+                    'open': float(ticker['openPrice']),
+                    'high': float(ticker['highPrice']),
+                    'low': float(ticker['lowPrice']),
+                    'close': float(ticker['lastPrice']),
+                    'volume': float(ticker['volume']),
+                    'quote_volume': float(ticker['quoteVolume']),
+                    'trade_num': int(ticker.get('count', 0)),
+                })
+
+            logger.info(f"获取到 {len(result)} 个 Binance {market_type} 批量行情")
+
+        except Exception as e:
+            logger.error(f"获取 Binance 批量行情时发生错误: {str(e)}")
+            import traceback
+            logger.error(traceback.format_exc())
+
+        return result
 
     def get_symbols(self) -> Dict[str, List[str]]:
         """获取 Binance 的 USDT 交易对"""
@@ -67,9 +199,7 @@ class BinanceExchange(BaseExchange):
         try:
             # 获取现货交易对
             spot_url = "https://api.binance.com/api/v3/exchangeInfo"
-            spot_response = self.session.get(spot_url)
-            spot_response.raise_for_status()
-            spot_info = spot_response.json()
+            spot_info = self._make_request(spot_url, weight=self.config['symbols_weight']['spot'])
 
             if spot_info and 'symbols' in spot_info:
                 for symbol in spot_info['symbols']:
@@ -81,9 +211,7 @@ class BinanceExchange(BaseExchange):
 
             # 获取永续合约交易对
             futures_url = "https://fapi.binance.com/fapi/v1/exchangeInfo"
-            futures_response = self.session.get(futures_url)
-            futures_response.raise_for_status()
-            futures_info = futures_response.json()
+            futures_info = self._make_request(futures_url, weight=self.config['symbols_weight']['futures'])
 
             if futures_info and 'symbols' in futures_info:
                 for symbol in futures_info['symbols']:
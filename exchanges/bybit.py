@@ -6,66 +6,71 @@ from typing import Dict, List, Optional, Any
 import requests
 
 from conf.config import EXCHANGE_CONFIG
-from exchanges.base import BaseExchange
+from exchanges.base import BaseExchange, DownloadError
 from utils import logger
-from utils.helpers import format_symbol
+from utils.helpers import format_symbol, is_window_closed, timeframe_to_ms
+from utils.http_cache import http_cache
+from utils.profiling import profiler
+from utils.retry import RETRYABLE_KINDS, RetryableError, classify_response, get_circuit_breaker, parse_retry_after
 
 
 class BybitExchange(BaseExchange):
     """Bybit交易所"""
 
+    # fetch_klines返回[start_time, end_time]内的全部K线(两端都包含)
+    KLINE_WINDOW_INCLUSIVE = True
+
+    # 限频错误码
+    RATE_LIMIT_CODES = (10006, 10018)
+    # 服务端超时/错误错误码
+    SERVER_ERROR_CODES = (10000, 10016)
+
     def __init__(self):
         super().__init__('bybit')
         self.config = EXCHANGE_CONFIG['bybit']
         self.base_url = self.config['base_url']
         self.session = requests.Session()
-        self.rate_limit_delay = 0.5  # 请求间隔时间(秒)
-        self.max_retries = 3  # 最大重试次数
 
-    def _make_request(self, endpoint: str, params: Dict[str, Any]) -> Optional[Dict]:
+    def _request_once(self, url: str, params: Dict[str, Any], immutable: bool, weight: int):
+        """发送一次HTTP请求，可重试的错误以RetryableError抛出"""
+        response = http_cache.get(self.session, url, params=params, timeout=10,
+                                  immutable=immutable,
+                                  limiter=self.rate_limiter, weight=weight,
+                                  validator=lambda d: d.get('retCode') == 0)
+        logger.info(f"响应状态码: {response.status_code}")
+
+        with profiler.stage('decode'):
+            data = response.json() if response.status_code == 200 else {}
+        error_code = data.get('retCode') if data.get('retCode') != 0 else None
+        kind = classify_response(response.status_code, error_code, self.RATE_LIMIT_CODES, self.SERVER_ERROR_CODES)
+        if kind in RETRYABLE_KINDS:
+            raise RetryableError(kind, f"HTTP {response.status_code}, 返回: {data}",
+                                 parse_retry_after(response.headers))
+        return response.status_code, data
+
+    def _make_request(self, endpoint: str, params: Dict[str, Any], immutable: bool = False,
+                      weight: int = 1) -> Optional[Dict]:
         """发送API请求并处理响应"""
         url = f"{self.base_url}{endpoint}"
-        retries = 0
-
-        while retries < self.max_retries:
-            try:
-                response = self.session.get(url, params=params, timeout=10)
-                logger.info(f"响应状态码: {response.status_code}")
-
-                if response.status_code == 429:  # 请求过于频繁
-                    wait_time = self.rate_limit_delay * (2 ** retries)
-                    logger.warning(f"请求频率限制，等待 {wait_time} 秒后重试")
-                    time.sleep(wait_time)
-                    retries += 1
-                    continue
-
-                if response.status_code != 200:
-                    logger.error(f"请求失败: HTTP {response.status_code}")
-                    return None
 
-                data = response.json()
+        try:
+            status_code, data = self.retry_policy.call(self._request_once, url, params, immutable, weight,
+                                                       breaker=get_circuit_breaker(f"bybit:{url}"))
+        except Exception as e:
+            logger.error(f"请求过程中发生错误: {str(e)}")
+            logger.error(f"请求URL: {url}")
+            logger.error(f"请求参数: {params}")
+            return None
 
-                if data['retCode'] != 0:
-                    logger.error(f"Bybit API错误: {data}")
-                    return None
+        if status_code != 200:
+            logger.error(f"请求失败: HTTP {status_code}")
+            return None
 
-                return data
+        if data['retCode'] != 0:
+            logger.error(f"Bybit API错误: {data}")
+            return None
 
-            except requests.Timeout:
-                logger.warning(f"请求超时，重试 ({retries+1}/{self.max_retries})")
-                retries += 1
-            except Exception as e:
-                logger.error(f"请求过程中发生错误: {str(e)}")
-                logger.error(f"请求URL: {url}")
-                logger.error(f"请求参数: {params}")
-                import traceback
-                logger.error(traceback.format_exc())
-                return None
-
-            # time.sleep(self.rate_limit_delay)
-
-        logger.error(f"达到最大重试次数 ({self.max_retries})")
-        return None
+        return data
 
     def fetch_klines(self, symbol: str, timeframe: str, start_time: int, end_time: int, market_type: str) -> List:
         """获取Bybit K线数据"""
@@ -76,53 +81,132 @@ class BybitExchange(BaseExchange):
 
         all_data = []
         current_start = start_time
-        max_limit = 500  # Bybit最大允许获取500条K线数据
+        max_limit = self.config['kline_limit']  # Bybit最大允许获取500条K线数据
+        # 每次请求的时间范围恰好容纳max_limit根K线
+        span = max_limit * timeframe_to_ms(timeframe)
 
-        while current_start < end_time:
+        while current_start <= end_time:
+            window_end = min(current_start + span - 1, end_time)
             params = {
                 'category': 'linear' if market_type == 'futures' else 'spot',
                 'symbol': formatted_symbol,
                 'interval': self.config['timeframe_map'][timeframe],
                 'start': current_start,
-                'end': min(current_start + (max_limit * 60 * 60 * 1000), end_time),  # 限制每次请求的时间范围
+                'end': window_end,
                 'limit': max_limit
             }
 
-            data = self._make_request(self.config['spot_endpoint'], params)
+            data = self._make_request(self.config['spot_endpoint'], params,
+                                      immutable=is_window_closed(window_end, timeframe),
+                                      weight=self.config['kline_weight'][market_type])
 
             if not data or 'result' not in data or 'list' not in data['result']:
-                logger.warning(f"没有获取到数据或数据格式错误")
-                break
+                raise DownloadError(f"Bybit {market_type} {symbol} 请求失败或数据格式错误")
 
+            # Bybit按时间倒序返回窗口内的K线，窗口内K线不超过max_limit根，一次即可取完
             klines = data['result']['list']
-            if not klines:
-                logger.info("没有更多数据")
-                break
+            if klines:
+                all_data.extend(klines)
+                logger.info(f"获取到 {len(klines)} 条数据")
 
-            all_data.extend(klines)
-            logger.info(f"获取到 {len(klines)} 条数据")
-
-            if len(klines) < max_limit:
-                break
-
-            # 更新开始时间
-            # Bybit返回的时间戳通常是字符串格式的毫秒时间戳
-            last_timestamp = int(klines[-1][0])  # 假设时间戳在第一个位置
-            current_start = last_timestamp + 1
-
-            # 避免请求过于频繁
-            # time.sleep(self.rate_limit_delay)
+            current_start = window_end + 1
 
         logger.info(f"Bybit {market_type} {symbol} 数据获取完成，共 {len(all_data)} 条")
         return all_data
 
+    def _fetch_dataset_window(self, dataset: str, params: Dict[str, Any], timeframe: str, end_time: int) -> List:
+        """请求数据集的一个窗口，窗口内的条数不超过limit，一次即可取完"""
+        spec = self.config['datasets'][dataset]
+        data = self._make_request(spec['endpoint'], {'category': 'linear', **params, 'limit': spec['limit']},
+                                  immutable=is_window_closed(end_time, timeframe),
+                                  weight=spec['weight'])
+        if not data or 'result' not in data or 'list' not in data['result']:
+            raise DownloadError(f"Bybit {params['symbol']} {dataset} 请求失败或数据格式错误")
+
+        rows = data['result']['list']
+        logger.info(f"获取到 {len(rows)} 条 Bybit {params['symbol']} {dataset} 数据")
+        return rows
+
+    def fetch_funding_rate(self, symbol: str, timeframe: str, start_time: int, end_time: int) -> List[tuple]:
+        """
+        获取Bybit永续合约资金费率
+
+        窗口按8小时结算间隔确定，结算更频繁的合约单次返回满limit条时从最早一条之前继续请求
+        """
+        limit = self.config['datasets']['funding_rate']['limit']
+        result = []
+        current_end = end_time
+        while current_end >= start_time:
+            params = {'symbol': format_symbol('bybit', symbol, 'futures'), 'startTime': start_time,
+                      'endTime': current_end}
+            # 按结算时间倒序返回
+            rows = self._fetch_dataset_window('funding_rate', params, timeframe, current_end)
+            result.extend((int(r['fundingRateTimestamp']), float(r['fundingRate'])) for r in rows)
+            if len(rows) < limit:
+                break
+            current_end = int(rows[-1]['fundingRateTimestamp']) - 1
+        return result
+
+    def fetch_open_interest(self, symbol: str, timeframe: str, start_time: int, end_time: int) -> List[tuple]:
+        """获取Bybit永续合约持仓量历史，Bybit不提供持仓价值"""
+        params = {
+            'symbol': format_symbol('bybit', symbol, 'futures'),
+            'intervalTime': self.config['datasets']['open_interest']['timeframe_map'][timeframe],
+            'startTime': start_time,
+            'endTime': end_time,
+        }
+        rows = self._fetch_dataset_window('open_interest', params, timeframe, end_time)
+        return [(int(r['timestamp']), float(r['openInterest']), None) for r in rows]
+
+    def fetch_mark_price(self, symbol: str, timeframe: str, start_time: int, end_time: int) -> List[tuple]:
+        """获取Bybit永续合约标记价格K线"""
+        params = {
+            'symbol': format_symbol('bybit', symbol, 'futures'),
+            'interval': self.config['timeframe_map'][timeframe],
+            'start': start_time,
+            'end': end_time,
+        }
+        rows = self._fetch_dataset_window('mark_price', params, timeframe, end_time)
+        return [(int(c[0]), float(c[1]), float(c[2]), float(c[3]), float(c[4])) for c in rows]
+
+    def fetch_tickers(self, market_type: str) -> List[Dict]:
+        """批量获取 Bybit USDT 交易对的24小时行情，每个市场一次请求"""
+        category = 'linear' if market_type == 'futures' else 'spot'
+        result = []
+
+        data = self._make_request(self.config['ticker_endpoint'], {'category': category},
+                                  weight=self.config['ticker_weight'][market_type])
+        if not data or 'result' not in data or 'list' not in data['result']:
+            return result
+
+        ts = int(data.get('time', time.time() * 1000))
+        for ticker in data['result']['list']:
+            symbol = ticker['symbol']
+            if not symbol.endswith('USDT'):
+                continue
+            result.append({
+                'symbol': f"{symbol[:-4]}/USDT",
+                'open_time': ts - 24 * 60 * 60 * 1000,
+                'close_time': ts,
+                'open': float(ticker['prevPrice24h'] or 0),
+                'high': float(ticker['highPrice24h'] or 0),
+                'low': float(ticker['lowPrice24h'] or 0),
+                'close': float(ticker['lastPrice'] or 0),
+                'volume': float(ticker['volume24h'] or 0),
+                'quote_volume': float(ticker['turnover24h'] or 0),
+                'trade_num': 0,
+            })
+
+        logger.info(f"获取到 {len(result)} 个 Bybit {market_type} 批量行情")
+        return result
+
     def get_symbols(self) -> Dict[str, List[str]]:
         """获取 Bybit 的 USDT 交易对"""
         result = {'spot': [], 'perpetual': []}
-        endpoint = "/v5/market/tickers"
+        endpoint = self.config['ticker_endpoint']
 
         # 获取现货交易对
-        spot_data = self._make_request(endpoint, {'category': 'spot'})
+        spot_data = self._make_request(endpoint, {'category': 'spot'}, weight=self.config['symbols_weight']['spot'])
         if spot_data and 'result' in spot_data and 'list' in spot_data['result']:
             for ticker in spot_data['result']['list']:
                 symbol = ticker['symbol']
@@ -135,7 +219,8 @@ class BybitExchange(BaseExchange):
             logger.info(f"Bybit 现货 USDT 交易对数量: {len(result['spot'])}")
 
         # 获取永续合约交易对
-        perpetual_data = self._make_request(endpoint, {'category': 'linear'})
+        perpetual_data = self._make_request(endpoint, {'category': 'linear'},
+                                            weight=self.config['symbols_weight']['futures'])
         if perpetual_data and 'result' in perpetual_data and 'list' in perpetual_data['result']:
             for ticker in perpetual_data['result']['list']:
                 symbol = ticker['symbol']
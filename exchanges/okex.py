@@ -1,91 +1,94 @@
 """OKEx交易所实现"""
-import time
 from datetime import datetime
 from typing import Dict, List, Tuple
 
 import requests
 
 from conf.config import EXCHANGE_CONFIG
-from exchanges.base import BaseExchange
+from exchanges.base import BaseExchange, DownloadError
 from utils import logger
-from utils.helpers import format_symbol
+from utils.helpers import format_symbol, is_window_closed
+from utils.http_cache import http_cache
+from utils.profiling import profiler
+from utils.retry import RETRYABLE_KINDS, RetryableError, classify_response, get_circuit_breaker, parse_retry_after
 
 
 class OKExExchange(BaseExchange):
     """OKEx交易所"""
 
+    # fetch_klines返回[start_time, end_time]内的全部K线(两端都包含)
+    KLINE_WINDOW_INCLUSIVE = True
+
+    # 限频错误码
+    RATE_LIMIT_CODES = ('50011', '50061')
+    # 系统繁忙/服务不可用错误码
+    SERVER_ERROR_CODES = ('50001', '50004', '50013', '50026')
+
     def __init__(self):
         super().__init__('okex')
         self.config = EXCHANGE_CONFIG['okex']
         self.base_url = self.config['base_url']
         self.session = requests.Session()
-        self.rate_limit_delay = 0.5  # 请求间隔时间(秒)
-        self.max_retries = 3  # 最大重试次数
 
-    def _make_request(self, url: str, params: Dict) -> Tuple[bool, Dict]:
+    def _request_once(self, url: str, params: Dict, immutable: bool, weight: int) -> Tuple[int, Dict]:
+        """发送一次HTTP请求，可重试的错误以RetryableError抛出"""
+        response = http_cache.get(self.session, url, params=params, timeout=10,
+                                  immutable=immutable,
+                                  limiter=self.rate_limiter, weight=weight,
+                                  validator=lambda d: d.get('code') == '0')
+
+        with profiler.stage('decode'):
+            data = response.json() if response.status_code == 200 else {}
+        error_code = data.get('code') if data.get('code') != '0' else None
+        kind = classify_response(response.status_code, error_code, self.RATE_LIMIT_CODES, self.SERVER_ERROR_CODES)
+        if kind in RETRYABLE_KINDS:
+            raise RetryableError(kind, f"HTTP {response.status_code}, 返回: {data}",
+                                 parse_retry_after(response.headers))
+        return response.status_code, data
+
+    def _make_request(self, url: str, params: Dict, immutable: bool = False,
+                      weight: int = 1) -> Tuple[bool, Dict]:
         """发送HTTP请求并处理常见错误"""
-        retries = 0
-
-        while retries < self.max_retries:
-            try:
-                response = self.session.get(url, params=params, timeout=10)
-
-                if response.status_code == 429:  # 请求过于频繁
-                    wait_time = self.rate_limit_delay * (2 ** retries)
-                    logger.warning(f"请求频率限制，等待 {wait_time} 秒后重试")
-                    time.sleep(wait_time)
-                    retries += 1
-                    continue
-
-                if response.status_code != 200:
-                    logger.error(f"请求失败: HTTP {response.status_code}, URL: {url}, 参数: {params}")
-                    return False, {"error": f"HTTP错误: {response.status_code}"}
-
-                data = response.json()
-                if data.get('code') != '0':
-                    logger.error(f"API返回错误: {data}, URL: {url}, 参数: {params}")
-                    return False, data
+        try:
+            status_code, data = self.retry_policy.call(self._request_once, url, params, immutable, weight,
+                                                       breaker=get_circuit_breaker(f"okex:{url}"))
+        except Exception as e:
+            logger.error(f"请求异常: {str(e)}, URL: {url}, 参数: {params}")
+            return False, {"error": str(e)}
 
-                return True, data
+        if status_code != 200:
+            logger.error(f"请求失败: HTTP {status_code}, URL: {url}, 参数: {params}")
+            return False, {"error": f"HTTP错误: {status_code}"}
 
-            except requests.Timeout:
-                logger.warning(f"请求超时，重试 ({retries+1}/{self.max_retries})")
-                retries += 1
-            except Exception as e:
-                logger.error(f"请求异常: {str(e)}, URL: {url}, 参数: {params}")
-                import traceback
-                logger.error(traceback.format_exc())
-                return False, {"error": str(e)}
+        if data.get('code') != '0':
+            logger.error(f"API返回错误: {data}, URL: {url}, 参数: {params}")
+            return False, data
 
-            # time.sleep(self.rate_limit_delay)
+        return True, data
 
-        return False, {"error": "达到最大重试次数"}
-
-    def fetch_klines(self, symbol: str, timeframe: str, start_time: int, end_time: int, market_type: str) -> List:
-        """获取OKEx K线数据"""
-        formatted_symbol = format_symbol('okex', symbol, market_type)
-        tf = self.config['timeframe_map'][timeframe]
-        endpoint = self.config['spot_endpoint'] if market_type == 'spot' else self.config['futures_endpoint']
-        url = f"{self.base_url}{endpoint}"
+    def _fetch_history(self, url: str, params: Dict, start_time: int, end_time: int, timeframe: str,
+                       weight: int, limit: int, cursor: str = 'after', get_ts=lambda row: int(row[0])) -> List:
+        """
+        按时间倒序分页获取[start_time, end_time]内的数据，OKX各历史接口通用
 
+        :param cursor: 分页参数名，接口返回早于该时间的数据
+        :param get_ts: 从一条数据中取出毫秒时间戳
+        """
         all_data = []
-        current_time = end_time
+        # 接口只返回严格早于cursor的数据，从end_time + 1开始才能包含end_time这一根
+        current_time = end_time + 1
         request_count = 0
         max_requests = 100  # 最大请求次数限制
 
-        logger.info(f"开始获取OKEX {market_type} 数据: {symbol}, 时间范围: {datetime.fromtimestamp(start_time/1000)} - {datetime.fromtimestamp(end_time/1000)}")
-
         while request_count < max_requests:
-            params = {
-                'instId': formatted_symbol,
-                'bar': tf,
-                'after': str(current_time),
-                'limit': '100'
-            }
-
-            success, data = self._make_request(url, params)
+            page_params = {**params, cursor: str(current_time), 'limit': str(limit)}
+
+            # cursor之前的数据在窗口收盘后不再变化
+            success, data = self._make_request(url, page_params,
+                                               immutable=is_window_closed(current_time, timeframe),
+                                               weight=weight)
             if not success:
-                break
+                raise DownloadError(f"OKEX 请求失败: {data}, URL: {url}")
 
             batch_data = data.get('data', [])
             if not batch_data:
@@ -93,27 +96,121 @@ class OKExExchange(BaseExchange):
                 break
 
             # 过滤有效数据
-            valid_data = [d for d in batch_data if start_time <= int(d[0]) <= end_time]
+            valid_data = [d for d in batch_data if start_time <= get_ts(d) <= end_time]
             if valid_data:
                 all_data.extend(valid_data)
                 logger.info(f"获取到 {len(valid_data)} 条有效数据")
 
             # 检查是否需要继续请求
-            earliest_ts = int(batch_data[-1][0])
-            if earliest_ts <= start_time or len(batch_data) < 100:
+            earliest_ts = get_ts(batch_data[-1])
+            if earliest_ts <= start_time or len(batch_data) < limit:
                 break
 
             current_time = earliest_ts
             request_count += 1
-            # time.sleep(self.rate_limit_delay)
+
+        if request_count >= max_requests:
+            # 窗口没有取完，不能当作完整的结果(否则缺失的部分会被记为交易所缺口)
+            raise DownloadError(f"OKEX 分页次数超过 {max_requests} 次，URL: {url}")
+        return all_data
+
+    def fetch_klines(self, symbol: str, timeframe: str, start_time: int, end_time: int, market_type: str) -> List:
+        """获取OKEx K线数据"""
+        formatted_symbol = format_symbol('okex', symbol, market_type)
+        tf = self.config['timeframe_map'][timeframe]
+        endpoint = self.config['spot_endpoint'] if market_type == 'spot' else self.config['futures_endpoint']
+        url = f"{self.base_url}{endpoint}"
+
+        logger.info(f"开始获取OKEX {market_type} 数据: {symbol}, 时间范围: {datetime.fromtimestamp(start_time/1000)} - {datetime.fromtimestamp(end_time/1000)}")
+
+        all_data = self._fetch_history(url, {'instId': formatted_symbol, 'bar': tf}, start_time, end_time, timeframe,
+                                       weight=self.config['kline_weight'][market_type],
+                                       limit=self.config['kline_limit'])
 
         logger.info(f"OKEX {market_type} {symbol} 数据获取完成，共 {len(all_data)} 条")
         return all_data
 
+    def fetch_funding_rate(self, symbol: str, timeframe: str, start_time: int, end_time: int) -> List[tuple]:
+        """获取OKX永续合约资金费率"""
+        spec = self.config['datasets']['funding_rate']
+        data = self._fetch_history(f"{self.base_url}{spec['endpoint']}",
+                                   {'instId': format_symbol('okex', symbol, 'futures')},
+                                   start_time, end_time, timeframe, spec['weight'], spec['limit'],
+                                   get_ts=lambda d: int(d['fundingTime']))
+        logger.info(f"OKEX {symbol} 资金费率获取完成，共 {len(data)} 条")
+        return [(int(d['fundingTime']), float(d['fundingRate'])) for d in data]
+
+    def fetch_open_interest(self, symbol: str, timeframe: str, start_time: int, end_time: int) -> List[tuple]:
+        """获取OKX永续合约持仓量历史"""
+        spec = self.config['datasets']['open_interest']
+        params = {
+            'instId': format_symbol('okex', symbol, 'futures'),
+            'period': spec['timeframe_map'][timeframe],
+            'begin': str(start_time),
+        }
+        # 返回 [ts, 持仓量(张), 持仓量(币), 持仓价值(USD)]
+        data = self._fetch_history(f"{self.base_url}{spec['endpoint']}", params,
+                                   start_time, end_time, timeframe, spec['weight'], spec['limit'], cursor='end')
+        logger.info(f"OKEX {symbol} 持仓量获取完成，共 {len(data)} 条")
+        return [(int(d[0]), float(d[2]), float(d[3])) for d in data]
+
+    def fetch_mark_price(self, symbol: str, timeframe: str, start_time: int, end_time: int) -> List[tuple]:
+        """获取OKX永续合约标记价格K线"""
+        spec = self.config['datasets']['mark_price']
+        params = {'instId': format_symbol('okex', symbol, 'futures'), 'bar': self.config['timeframe_map'][timeframe]}
+        data = self._fetch_history(f"{self.base_url}{spec['endpoint']}", params,
+                                   start_time, end_time, timeframe, spec['weight'], spec['limit'])
+        logger.info(f"OKEX {symbol} 标记价格K线获取完成，共 {len(data)} 条")
+        return [(int(c[0]), float(c[1]), float(c[2]), float(c[3]), float(c[4])) for c in data]
+
+    def fetch_tickers(self, market_type: str) -> List[Dict]:
+        """批量获取 OKX USDT 交易对的24小时行情，每个市场一次请求"""
+        inst_type = 'SPOT' if market_type == 'spot' else 'SWAP'
+        url = f"{self.base_url}{self.config['ticker_endpoint']}"
+        result = []
+
+        success, data = self._make_request(url, {'instType': inst_type},
+                                           weight=self.config['ticker_weight'][market_type])
+        if not success:
+            return result
+
+        for ticker in data.get('data', []):
+            parts = ticker['instId'].split('-')
+            if len(parts) < 2 or parts[1] != 'USDT':
+                continue
+            if inst_type == 'SWAP' and (len(parts) != 3 or parts[2] != 'SWAP'):
+                continue
+
+            ts = int(ticker['ts'])
+            last = float(ticker['last'] or 0)
+            if inst_type == 'SPOT':
+                volume = float(ticker['vol24h'] or 0)
+                quote_volume = float(ticker['volCcy24h'] or 0)
+            else:
+                # 永续合约的vol24h单位为张，volCcy24h为币
+                volume = float(ticker['volCcy24h'] or 0)
+                quote_volume = volume * last
+
+            result.append({
+                'symbol': f"{parts[0]}/USDT",
+                'open_time': ts - 24 * 60 * 60 * 1000,
+                'close_time': ts,
+                'open': float(ticker['open24h'] or 0),
+                'high': float(ticker['high24h'] or 0),
+                'low': float(ticker['low24h'] or 0),
+                'close': last,
+                'volume': volume,
+                'quote_volume': quote_volume,
+                'trade_num': 0,
+            })
+
+        logger.info(f"获取到 {len(result)} 个 OKEX {market_type} 批量行情")
+        return result
+
     def get_symbols(self) -> Dict[str, List[str]]:
         """获取 OKX 的 USDT 交易对"""
         result = {'spot': [], 'perpetual': []}
-        endpoint = "/api/v5/market/tickers"
+        endpoint = self.config['ticker_endpoint']
 
         try:
             # 使用一个通用函数处理不同类型的交易对
@@ -121,7 +218,8 @@ class OKExExchange(BaseExchange):
                 url = f"{self.base_url}{endpoint}"
                 params = {'instType': inst_type}
 
-                success, data = self._make_request(url, params)
+                market_type = 'spot' if inst_type == 'SPOT' else 'futures'
+                success, data = self._make_request(url, params, weight=self.config['symbols_weight'][market_type])
                 if not success:
                     return
 
@@ -1,6 +1,8 @@
 """主程序入口"""
+import argparse
 import asyncio
 import datetime
+import itertools
 import multiprocessing
 import os
 import platform
@@ -8,75 +10,236 @@ import time
 from datetime import timezone
 from functools import partial
 
-from apscheduler.schedulers.background import BackgroundScheduler
-
-from conf.config import DEFAULT_DOWNLOAD_CONFIG
+from conf.config import DEFAULT_DOWNLOAD_CONFIG, PRIORITY_CONFIG, PROFILE_CONFIG, SCHEDULER_CONFIG
+from db import jobs
 from db.connection import db_manager
+from db.schema import ensure_schema
 from exchanges import get_exchange
-from utils import logger
-
-
-async def download_with_error_handling(exchange, symbol, timeframe, start_time, end_time, market_type):
-    """带错误处理的下载包装函数"""
+from exchanges.base import DATASETS, dataset_start_time, dataset_timeframes, get_window_spec
+from orchestrator import Orchestrator
+from planner import format_plan, gap_ranges, load_coverage, missing_ranges, plan_download
+from utils import logger, setup_logging
+from utils.helpers import split_windows, timeframe_to_ms, to_ms
+from utils.priority import PriorityScheduler, worker_count
+from utils.profiling import profiler
+from worker import DistributedWorker
+
+
+async def download_with_error_handling(exchange, symbol, timeframe, start_time, end_time, market_type,
+                                      dataset='klines'):
+    """
+    带错误处理的下载包装函数
+
+    :return: 窗口是否下载并写入成功
+    """
     try:
         await exchange.download_data(
             symbol=symbol,
             timeframe=timeframe,
             start_time=start_time,
             end_time=end_time,
-            market_type=market_type
+            market_type=market_type,
+            dataset=dataset
         )
+        return True
     except Exception as e:
-        logger.error(f"处理 {exchange.name} {market_type} {symbol} {timeframe} 时发生错误: {str(e)}")
+        logger.error(f"处理 {exchange.name} {market_type} {symbol} {timeframe} {dataset} 时发生错误: {str(e)}")
         import traceback
         logger.error(traceback.format_exc())
+        return False
+
+
+async def fetch_market_tickers(exchange, market_types):
+    """
+    在线程中获取各市场的批量行情，刷新最新行情和交易对排序共用同一次请求
+
+    :return: {market_type: tickers}，不支持批量行情的市场为None
+    """
+    result = {}
+    for market_type in market_types:
+        try:
+            result[market_type] = await asyncio.to_thread(exchange.fetch_tickers, market_type)
+        except NotImplementedError as e:
+            logger.warning(str(e))
+            result[market_type] = None
+    return result
+
+
+async def refresh_exchange_latest(exchange, market_tickers):
+    """
+    通过批量行情刷新交易所全部交易对的最新行情
+
+    :param market_tickers: fetch_market_tickers 的结果
+    """
+    for market_type, tickers in market_tickers.items():
+        if tickers is None:
+            continue
+        try:
+            await exchange.refresh_latest_bars(market_type, tickers)
+        except Exception as e:
+            logger.error(f"刷新 {exchange.name} {market_type} 最新行情时发生错误: {str(e)}")
+            import traceback
+            logger.error(traceback.format_exc())
+
+
+def get_symbol_weights(market_tickers):
+    """
+    以24小时成交额作为交易对的重要性权重
+
+    :param market_tickers: fetch_market_tickers 的结果
+    :return: {market_type: {symbol: 权重}}
+    """
+    return {
+        market_type: {ticker['symbol']: ticker['quote_volume'] for ticker in tickers or []}
+        for market_type, tickers in market_tickers.items()
+    }
+
+
+def iter_download_windows(exchange, symbols_dict, config, coverage=None, weights=None, lane=None):
+    """
+    将下载配置展开为请求窗口
+
+    最近live_window内的窗口进入live通道，其余进入配置的lane(默认backfill)；
+    已入库序列中间尚未确认的缺口进入repair通道；配置 since_latest 为True时，
+    已入库的K线序列从其最新一根K线之后开始下载，不受start_time限制，以补齐之前失败的日期
+
+    窗口按需生成，成交额高的交易对在前、同一序列内较新的窗口在前
+
+    :param coverage: load_coverage 返回的已入库区间，其中的K线不再重复下载
+    :param weights: get_symbol_weights 的结果
+    :param lane: 只生成指定通道的窗口，None表示全部
+
+    :return: 生成 (lane, weight, market_type, symbol, timeframe, dataset, window_start, window_end)，
+             时间为毫秒时间戳
+    """
+    market_types = config.get('market_types', DEFAULT_DOWNLOAD_CONFIG['market_types'])
+    timeframes = config.get('timeframes', [DEFAULT_DOWNLOAD_CONFIG['timeframe']])
+    start_ts = to_ms(config.get('start_time', datetime.datetime(2023, 1, 1, tzinfo=timezone.utc)))
+    end_ts = to_ms(config.get('end_time', datetime.datetime.now(timezone.utc)))
+    live_since = end_ts - PRIORITY_CONFIG['live_window'] * 1000
+    history_lane = config.get('lane', 'backfill')
+    datasets = config.get('datasets', ['klines'])
+
+    for market_type in market_types:
+        symbol_key = 'perpetual' if market_type == 'futures' else market_type
+        # 成交活跃的交易对优先
+        market_weights = (weights or {}).get(market_type, {})
+        symbols = sorted(symbols_dict.get(symbol_key, []),
+                         key=lambda s: market_weights.get(f"{s}/USDT", 0.0), reverse=True)
+
+        for symbol in symbols:
+            pair = f"{symbol}/USDT"
+            for dataset in datasets:
+                for timeframe in dataset_timeframes(dataset, timeframes):
+                    spec = get_window_spec(exchange.config, dataset, market_type, timeframe)
+                    if spec is None:
+                        continue
+                    bars_per_window = spec[0]
+                    # kline_latest只记录K线的覆盖范围
+                    covered = coverage.get((pair, timeframe)) if coverage and dataset == 'klines' else None
+                    series_start = dataset_start_time(exchange.config, dataset, start_ts)
+                    if config.get('since_latest') and covered is not None:
+                        series_start = min(start_ts, covered[1] + timeframe_to_ms(timeframe))
+                    ranges = [(s, e, None) for s, e in missing_ranges(series_start, end_ts, covered, timeframe)]
+                    ranges += [(s, e, 'repair') for s, e in gap_ranges(series_start, end_ts, covered)]
+                    for range_start, range_end, range_lane in ranges:
+                        for window_start, window_end in reversed(split_windows(range_start, range_end, timeframe,
+                                                                               bars_per_window)):
+                            window_lane = range_lane or ('live' if window_end >= live_since else history_lane)
+                            if lane is not None and window_lane != lane:
+                                continue
+                            yield (window_lane, market_weights.get(pair, 0.0), market_type, pair, timeframe,
+                                   dataset, window_start, window_end)
+
+
+async def load_download_coverage(exchange_name, config):
+    """增量模式(默认)下读取已入库区间，full模式返回None"""
+    if not config.get('incremental', True):
+        return None
+    timeframes = config.get('timeframes', [DEFAULT_DOWNLOAD_CONFIG['timeframe']])
+    return await load_coverage(exchange_name, timeframes)
+
+
+async def run_exchange_tasks(exchange, config, get_symbols):
+    """
+    执行单个交易所的下载任务
+
+    :param exchange: 交易所实例
+    :param config: 下载配置
+    :param get_symbols: 返回交易对列表的函数，常驻进程中为带缓存的版本
+    :return: 下载失败的窗口数
+    """
+    market_types = config.get('market_types', DEFAULT_DOWNLOAD_CONFIG['market_types'])
+    max_concurrent = config.get('max_concurrent_tasks', DEFAULT_DOWNLOAD_CONFIG['max_concurrent_tasks'])
+    exchange_name = exchange.name
+
+    logger.info(f"进程 {os.getpid()} 开始处理交易所: {exchange_name}")
+
+    # latest: 只通过批量接口刷新最新行情；history: 只按交易对分页下载历史K线；all: 两者都执行
+    mode = config.get('mode', 'all')
+    # 批量行情只请求一次，同时用于刷新最新行情和按成交额排序交易对
+    market_tickers = await fetch_market_tickers(exchange, market_types)
+    if mode in ('latest', 'all'):
+        await refresh_exchange_latest(exchange, market_tickers)
+    if mode == 'latest':
+        return 0
+
+    symbols_dict = await asyncio.to_thread(get_symbols)
+    logger.info(f"{exchange_name} 获取到 {sum(len(v) for v in symbols_dict.values())} 个交易对")
+
+    scheduler = PriorityScheduler(PRIORITY_CONFIG['lanes'], max_concurrent,
+                                  batch_size=PRIORITY_CONFIG['batch_size'])
+    failed = []
+
+    async def download(*args):
+        if not await download_with_error_handling(*args):
+            failed.append(args)
+
+    with profiler.stage('plan'):
+        coverage = await load_download_coverage(exchange_name, config)
+        weights = get_symbol_weights(market_tickers)
+        # 每个通道一个惰性来源，窗口在执行过程中分批生成
+        for lane_name in scheduler.lane_names:
+            scheduler.add_source(lane_name, (
+                (download, (exchange, pair, timeframe, window_start, window_end, market_type, dataset),
+                 weight, window_end)
+                for _, weight, market_type, pair, timeframe, dataset, window_start, window_end in
+                iter_download_windows(exchange, symbols_dict, config, coverage, weights, lane_name)
+            ))
+
+    # 执行所有任务并等待完成
+    logger.info(f"{exchange_name} 开始执行下载任务，"
+                f"并发数: {worker_count(PRIORITY_CONFIG['lanes'], max_concurrent)}")
+    await scheduler.run()
+    if failed:
+        logger.error(f"{exchange_name} 下载任务已结束，{len(failed)} 个窗口失败")
+    else:
+        logger.info(f"{exchange_name} 所有下载任务已完成")
+    return len(failed)
 
 
 async def process_exchange(exchange_name, config):
     """处理单个交易所的所有下载任务"""
+    # 按调度器实际运行的下载协程数和参与下载的进程数确定连接池大小
+    max_concurrent = config.get('max_concurrent_tasks', DEFAULT_DOWNLOAD_CONFIG['max_concurrent_tasks'])
+    db_manager.configure(
+        concurrency=worker_count(PRIORITY_CONFIG['lanes'], max_concurrent),
+        process_count=len(config.get('exchanges', DEFAULT_DOWNLOAD_CONFIG['exchanges'])),
+    )
+    # 分析模式下统计各阶段耗时，并在进程内采样调用栈
+    profile_dir = config.get('profile')
+    if profile_dir:
+        profiler.start(profile_dir, config.get('sample_interval', PROFILE_CONFIG['sample_interval']))
+
     # 创建数据库连接池
     await db_manager.create_pool()
 
     try:
-        market_types = config.get('market_types', DEFAULT_DOWNLOAD_CONFIG['market_types'])
-        timeframes = config.get('timeframes', DEFAULT_DOWNLOAD_CONFIG['timeframe'])
-        max_concurrent = config.get('max_concurrent_tasks', DEFAULT_DOWNLOAD_CONFIG['max_concurrent_tasks'])
-        start_time = config.get('start_time', datetime.datetime(2023, 1, 1, tzinfo=timezone.utc))
-        end_time = config.get('end_time', datetime.datetime.now(timezone.utc))
-
-        logger.info(f"进程 {os.getpid()} 开始处理交易所: {exchange_name}")
+        await ensure_schema()
 
         # 获取交易所实例
         exchange = get_exchange(exchange_name)
-
-        symbols_dict = exchange.get_symbols()
-        logger.info(f"{exchange_name} 获取到 {sum(len(v) for v in symbols_dict.values())} 个交易对")
-
-        # 创建下载任务
-        tasks = []
-        for market_type in market_types:
-            symbol_key = 'perpetual' if market_type == 'futures' else market_type
-
-            for symbol in symbols_dict.get(symbol_key, []):
-                for timeframe in timeframes:
-                    tasks.append(
-                        download_with_error_handling(
-                            exchange, f"{symbol}/USDT", timeframe,
-                            start_time, end_time, market_type
-                        )
-                    )
-
-        # 使用信号量限制并发数量
-        semaphore = asyncio.Semaphore(max_concurrent)
-
-        async def bounded_download(coro):
-            async with semaphore:
-                return await coro
-
-        # 执行所有任务并等待完成
-        logger.info(f"{exchange_name} 开始执行 {len(tasks)} 个下载任务，最大并发数: {max_concurrent}")
-        await asyncio.gather(*(bounded_download(task) for task in tasks))
-        logger.info(f"{exchange_name} 所有下载任务已完成")
+        await run_exchange_tasks(exchange, config, exchange.get_symbols)
 
     except Exception as e:
         logger.error(f"处理交易所 {exchange_name} 时发生错误: {str(e)}")
@@ -84,12 +247,16 @@ async def process_exchange(exchange_name, config):
         logger.error(traceback.format_exc())
 
     finally:
+        if profile_dir:
+            summary = profiler.stop(exchange_name)
+            logger.info(f"{exchange_name} 各阶段耗时(结果已写入 {profile_dir}):\n{profiler.format_summary(summary)}")
         # 关闭连接池
         await db_manager.close_pool()
 
 
 def run_exchange_process(exchange_name, config):
     """在单独的进程中运行交易所处理函数"""
+    setup_logging()
     try:
         logger.info(f"启动进程处理交易所: {exchange_name}")
         asyncio.run(process_exchange(exchange_name, config))
@@ -131,30 +298,77 @@ def run_download(config=None):
 
 async def get_exchanges_from_db():
     """从数据库获取所有可用的交易所信息"""
+    conn = None
     try:
-        await db_manager.create_pool()
-        async with db_manager.pool.acquire() as conn:
-            query = "SELECT exchange_name FROM exchanges"
-            rows = await conn.fetch(query)
-            exchanges = [row['exchange_name'] for row in rows]
-            logger.info(f"从数据库获取到 {len(exchanges)} 个交易所: {', '.join(exchanges)}")
+        # 一次性查询使用直连，不创建连接池
+        conn = await db_manager.connect()
+        query = "SELECT exchange_name FROM exchanges"
+        rows = await conn.fetch(query)
+        exchanges = [row['exchange_name'] for row in rows]
+        logger.info(f"从数据库获取到 {len(exchanges)} 个交易所: {', '.join(exchanges)}")
     except Exception as e:
         logger.error(f"从数据库获取交易所信息失败: {str(e)}")
         # 如果数据库查询失败，使用默认值
         exchanges = ['okex', 'binance', 'bybit']
         logger.warning(f"使用默认交易所列表: {', '.join(exchanges)}")
     finally:
-        await db_manager.close_pool()
+        if conn is not None:
+            await conn.close()
     return exchanges
     # return ['binance']
 
 
-def scheduled_job():
-    """每日执行的定时任务"""
+async def enqueue_download(config):
+    """将下载配置展开为窗口写入分布式任务队列，由 worker 模式的进程领取执行"""
+    lane_priority = {lane['name']: i for i, lane in enumerate(PRIORITY_CONFIG['lanes'])}
+    total = 0
+
+    db_manager.configure(concurrency=1)
+    await db_manager.create_pool()
+    try:
+        await ensure_schema()
+        for exchange_name in config.get('exchanges', DEFAULT_DOWNLOAD_CONFIG['exchanges']):
+            exchange = get_exchange(exchange_name)
+            symbols_dict = await asyncio.to_thread(exchange.get_symbols)
+            market_types = config.get('market_types', DEFAULT_DOWNLOAD_CONFIG['market_types'])
+            weights = get_symbol_weights(await fetch_market_tickers(exchange, market_types))
+            coverage = await load_download_coverage(exchange_name, config)
+            download_jobs = (
+                {
+                    'exchange_name': exchange_name, 'market_type': market_type, 'symbol': pair,
+                    'timeframe': timeframe, 'dataset': dataset, 'start_time': window_start, 'end_time': window_end,
+                    'priority': lane_priority[lane], 'weight': weight,
+                }
+                for lane, weight, market_type, pair, timeframe, dataset, window_start, window_end in
+                iter_download_windows(exchange, symbols_dict, config, coverage, weights)
+            )
+            # 分批写入，避免一次在内存中展开全部窗口
+            count = 0
+            while batch := list(itertools.islice(download_jobs, PRIORITY_CONFIG['batch_size'])):
+                count += await jobs.enqueue_jobs(batch, rerun=config.get('rerun', False))
+            total += count
+            logger.info(f"{exchange_name} 已写入 {count} 个下载任务")
+    finally:
+        await db_manager.close_pool()
+    return total
+
+
+# 最近一次完成历史K线下载的UTC日期
+_last_history_day = None
+
+
+def scheduled_job(orchestrator, tick_time):
+    """
+    定时任务：每次通过批量接口刷新最新行情，每个UTC日下载一次历史K线
+
+    历史K线从各序列已入库的最新K线开始下载到当日0点，全部交易所成功后才标记当日已完成，
+    失败时下一次tick继续重试
+    """
+    global _last_history_day
     logger.info("开始执行每日数据下载任务")
 
     # 设置今天的日期范围
-    today = datetime.datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    today = tick_time.replace(hour=0, minute=0, second=0, microsecond=0)
     yesterday = today - datetime.timedelta(days=1)
 
     config = {
@@ -162,43 +376,137 @@ def scheduled_job():
         'timeframes': ['15m', '1h', '4h', '1d'],
         'start_time': yesterday,
         'end_time': today,
-        'max_concurrent_tasks': 3
+        'since_latest': True,
+        'max_concurrent_tasks': orchestrator.max_concurrent_tasks,
+        'mode': 'latest' if _last_history_day == today.date() else 'all',
     }
 
-    # 从数据库获取交易所列表
-    exchanges = asyncio.run(get_exchanges_from_db())
-    config['exchanges'] = exchanges
+    # 每日下载历史数据时从数据库刷新交易所列表
+    if config['mode'] == 'all' or not orchestrator.workers:
+        orchestrator.ensure_workers(asyncio.run(get_exchanges_from_db()))
 
-    run_download(config)
+    results = orchestrator.dispatch(config)
+    failed = [name for name, success in results.items() if not success]
+    if failed:
+        logger.error(f"以下交易所本次任务失败: {', '.join(failed)}")
+    if config['mode'] == 'all' and results and not failed:
+        _last_history_day = today.date()
     logger.info("每日数据下载任务执行完毕")
 
 
-def main():
+def run_scheduler():
     logger.info("启动定时任务程序")
 
-    scheduler = BackgroundScheduler()
-
-    scheduler.add_job(
-        scheduled_job,
-        trigger="interval",
-        minutes=15,
-        id='daily_download',
-        name='每日数据下载任务'
-    )
-
-    # 启动调度器
-    scheduler.start()
-    logger.info("调度器已启动，任务将在每天 00:00 执行")
-
-    # 立即运行一次任务（可选）
-    scheduled_job()
+    orchestrator = Orchestrator(run_exchange_tasks, **SCHEDULER_CONFIG)
+    logger.info(f"调度器已启动，任务将在每 {SCHEDULER_CONFIG['interval_minutes']} 分钟的K线收盘后执行")
 
     try:
+        # 立即运行一次任务，之后对齐到K线收盘边界，上一次未完成时不会开始下一次
+        tick_time = datetime.datetime.now(timezone.utc)
         while True:
-            time.sleep(1)
+            started = time.monotonic()
+            scheduled_job(orchestrator, tick_time)
+            elapsed = time.monotonic() - started
+            if elapsed > orchestrator.interval:
+                logger.warning(f"本次任务耗时 {elapsed:.0f} 秒，超过调度间隔，跳过错过的调度点")
+            tick_time = orchestrator.sleep_until_next_tick()
     except (KeyboardInterrupt, SystemExit):
-        scheduler.shutdown()
-        logger.info("调度器已关闭")
+        pass
+    finally:
+        orchestrator.shutdown()
+
+
+def parse_datetime(value):
+    """解析命令行中的UTC时间"""
+    return datetime.datetime.fromisoformat(value).replace(tzinfo=timezone.utc)
+
+
+def add_download_arguments(parser):
+    """添加下载配置相关的命令行参数"""
+    parser.add_argument('--exchanges', nargs='+', default=DEFAULT_DOWNLOAD_CONFIG['exchanges'])
+    parser.add_argument('--market-types', nargs='+', default=DEFAULT_DOWNLOAD_CONFIG['market_types'])
+    parser.add_argument('--timeframes', nargs='+', default=[DEFAULT_DOWNLOAD_CONFIG['timeframe']])
+    parser.add_argument('--start', help='开始时间(UTC)，如 2023-01-01')
+    parser.add_argument('--end', help='结束时间(UTC)，默认为当前时间')
+    parser.add_argument('--lane', default='backfill', help='历史窗口所属通道')
+    parser.add_argument('--datasets', nargs='+', choices=DATASETS, default=['klines'],
+                        help='下载的数据集，klines之外的数据集只下载永续合约')
+    parser.add_argument('--full', action='store_true', help='忽略kline_latest中的已入库区间，全部重新下载')
+
+
+def build_download_config(args):
+    """根据命令行参数生成下载配置"""
+    config = {
+        'exchanges': args.exchanges,
+        'market_types': args.market_types,
+        'timeframes': args.timeframes,
+        'lane': args.lane,
+        'datasets': args.datasets,
+        'incremental': not args.full,
+    }
+    if getattr(args, 'mode', None):
+        config['mode'] = args.mode
+    if args.start:
+        config['start_time'] = parse_datetime(args.start)
+    if args.end:
+        config['end_time'] = parse_datetime(args.end)
+    return config
+
+
+def main():
+    parser = argparse.ArgumentParser(description='交易所K线数据下载')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('schedule', help='常驻定时下载(默认)')
+
+    enqueue_parser = subparsers.add_parser('enqueue', help='将下载窗口写入分布式任务队列')
+    add_download_arguments(enqueue_parser)
+    enqueue_parser.add_argument('--rerun', action='store_true', help='已完成的相同窗口也重新执行')
+
+    download_parser = subparsers.add_parser('download', help='按配置执行一次下载')
+    add_download_arguments(download_parser)
+    download_parser.add_argument('--mode', choices=['all', 'history', 'latest'], default='all')
+    download_parser.add_argument('--max-concurrent', type=int, default=DEFAULT_DOWNLOAD_CONFIG['max_concurrent_tasks'])
+    download_parser.add_argument('--profile', nargs='?', const=PROFILE_CONFIG['output_dir'], default=None,
+                                 help='统计各阶段耗时并采样调用栈，结果写入指定目录')
+    download_parser.add_argument('--sample-interval', type=float, default=PROFILE_CONFIG['sample_interval'],
+                                 help='采样间隔(秒)，0表示只统计阶段耗时')
+
+    plan_parser = subparsers.add_parser('plan', help='估算下载所需的请求数、权重、写入行数和耗时')
+    add_download_arguments(plan_parser)
+    plan_parser.add_argument('--mode', choices=['all', 'history', 'latest'], default='history')
+    plan_parser.add_argument('--ignore-coverage', action='store_true', help='不扣除已入库的K线区间')
+
+    worker_parser = subparsers.add_parser('worker', help='从分布式任务队列领取并执行下载任务')
+    worker_parser.add_argument('--exchanges', nargs='+', default=None, help='只领取指定交易所的任务')
+    worker_parser.add_argument('--concurrency', type=int, default=None)
+    worker_parser.add_argument('--worker-id', default=None)
+    worker_parser.add_argument('--exit-when-idle', action='store_true', help='队列为空时退出')
+
+    args = parser.parse_args()
+    # 日志文件只在实际执行命令时创建
+    setup_logging()
+
+    if args.command == 'download':
+        config = build_download_config(args)
+        config.update({
+            'max_concurrent_tasks': args.max_concurrent,
+            'profile': args.profile,
+            'sample_interval': args.sample_interval,
+        })
+        run_download(config)
+    elif args.command == 'enqueue':
+        config = build_download_config(args)
+        config['rerun'] = args.rerun
+        asyncio.run(enqueue_download(config))
+    elif args.command == 'plan':
+        use_coverage = not (args.ignore_coverage or args.full)
+        plan = asyncio.run(plan_download(build_download_config(args), use_coverage))
+        print(format_plan(plan))
+    elif args.command == 'worker':
+        worker = DistributedWorker(args.worker_id, args.exchanges, args.concurrency, args.exit_when_idle)
+        asyncio.run(worker.run())
+    else:
+        run_scheduler()
 
 
 if __name__ == "__main__":
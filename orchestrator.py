@@ -0,0 +1,183 @@
+"""常驻调度器：按K线收盘边界对齐触发，常驻工作进程复用HTTP会话、数据库连接池和缓存"""
+import asyncio
+import datetime
+import multiprocessing
+import os
+import queue
+import time
+from datetime import timezone
+
+from conf.config import PRIORITY_CONFIG
+from db.connection import db_manager
+from db.schema import ensure_schema
+from exchanges import get_exchange
+from utils import logger, setup_logging
+from utils.priority import worker_count
+
+
+class ExchangeWorker:
+    """单个交易所的常驻工作进程状态，进程内跨tick复用交易所实例、连接池和交易对缓存"""
+
+    def __init__(self, exchange_name, run_tick, symbols_ttl, process_count=1, max_concurrent=1):
+        self.exchange_name = exchange_name
+        self.run_tick = run_tick
+        self.symbols_ttl = symbols_ttl
+        self.process_count = process_count
+        self.max_concurrent = max_concurrent
+        self.exchange = None
+        self._symbols = None
+        self._symbols_at = 0.0
+
+    def get_symbols(self):
+        """获取交易对列表，缓存symbols_ttl秒"""
+        if self._symbols is None or time.monotonic() - self._symbols_at > self.symbols_ttl:
+            self._symbols = self.exchange.get_symbols()
+            self._symbols_at = time.monotonic()
+        return self._symbols
+
+    async def serve(self, commands, results):
+        """循环接收tick配置并执行，收到None时退出"""
+        # 按tick中实际运行的下载协程数确定连接池大小，各交易所进程平分全局连接预算
+        db_manager.configure(worker_count(PRIORITY_CONFIG['lanes'], self.max_concurrent), self.process_count)
+        await db_manager.create_pool()
+        try:
+            await ensure_schema()
+            self.exchange = get_exchange(self.exchange_name)
+            loop = asyncio.get_running_loop()
+
+            while True:
+                config = await loop.run_in_executor(None, commands.get)
+                if config is None:
+                    break
+
+                started = time.monotonic()
+                try:
+                    failed = await self.run_tick(self.exchange, config, self.get_symbols)
+                    if failed:
+                        logger.error(f"进程 {os.getpid()} 处理交易所 {self.exchange_name} 时 {failed} 个窗口失败")
+                    results.put((self.exchange_name, not failed, time.monotonic() - started))
+                except Exception as e:
+                    logger.error(f"进程 {os.getpid()} 处理交易所 {self.exchange_name} 时发生错误: {str(e)}")
+                    import traceback
+                    logger.error(traceback.format_exc())
+                    results.put((self.exchange_name, False, time.monotonic() - started))
+        finally:
+            await db_manager.close_pool()
+
+
+def _worker_main(exchange_name, run_tick, symbols_ttl, process_count, max_concurrent, commands, results):
+    """工作进程入口"""
+    setup_logging()
+    logger.info(f"启动常驻进程 {os.getpid()} 处理交易所: {exchange_name}")
+    worker = ExchangeWorker(exchange_name, run_tick, symbols_ttl, process_count, max_concurrent)
+    try:
+        asyncio.run(worker.serve(commands, results))
+    except KeyboardInterrupt:
+        pass
+
+
+class Orchestrator:
+    """
+    常驻调度器
+
+    - 每个交易所一个常驻工作进程，tick之间不重建进程、连接池和HTTP会话
+    - tick对齐到K线收盘边界(加上delay_seconds等待交易所落盘)
+    - 上一次tick未完成时不会开始下一次，超时错过的边界直接跳过
+    """
+
+    def __init__(self, run_tick, interval_minutes=15, delay_seconds=10, symbols_ttl=3600, max_concurrent_tasks=3):
+        """
+        :param run_tick: 协程函数 run_tick(exchange, config, get_symbols)，在工作进程中执行，返回失败的窗口数
+        :param max_concurrent_tasks: 每次tick的下载并发数，工作进程据此确定连接池大小
+        """
+        self.run_tick = run_tick
+        self.interval = interval_minutes * 60
+        self.delay = delay_seconds
+        self.symbols_ttl = symbols_ttl
+        self.max_concurrent_tasks = max_concurrent_tasks
+        self.results = multiprocessing.Queue()
+        self.workers = {}  # exchange_name -> (进程, 命令队列)
+
+    def _start_worker(self, exchange_name, process_count):
+        commands = multiprocessing.Queue()
+        process = multiprocessing.Process(
+            target=_worker_main,
+            args=(exchange_name, self.run_tick, self.symbols_ttl, process_count, self.max_concurrent_tasks,
+                  commands, self.results),
+            name=f"worker-{exchange_name}",
+            daemon=True,
+        )
+        process.start()
+        self.workers[exchange_name] = (process, commands)
+
+    def ensure_workers(self, exchange_names):
+        """确保每个交易所都有存活的工作进程，并停止不再需要的进程"""
+        for name in list(self.workers):
+            if name not in exchange_names:
+                self._stop_worker(name)
+
+        for name in exchange_names:
+            process, _ = self.workers.get(name, (None, None))
+            if process is None or not process.is_alive():
+                if process is not None:
+                    logger.warning(f"交易所 {name} 的工作进程已退出(exitcode={process.exitcode})，重新启动")
+                self._start_worker(name, len(exchange_names))
+
+    def dispatch(self, config):
+        """
+        向所有工作进程下发一次tick并等待全部完成
+
+        :return: {exchange_name: 是否成功}，有窗口失败或进程异常退出时为False
+        """
+        self.ensure_workers(list(self.workers))
+        for _, commands in self.workers.values():
+            commands.put(config)
+
+        pending = set(self.workers)
+        results = {}
+        while pending:
+            try:
+                name, success, elapsed = self.results.get(timeout=1)
+            except queue.Empty:
+                # 工作进程异常退出时不再等待其结果
+                for name in list(pending):
+                    process, _ = self.workers[name]
+                    if not process.is_alive():
+                        logger.error(f"交易所 {name} 的工作进程在执行中退出")
+                        pending.discard(name)
+                        results[name] = False
+                continue
+
+            pending.discard(name)
+            results[name] = success
+            logger.info(f"{name} {'处理完成' if success else '处理失败'}，耗时 {elapsed:.1f} 秒")
+        return results
+
+    def next_tick(self, now=None):
+        """下一个K线收盘边界(加上延迟)的时间"""
+        if now is None:
+            now = time.time()
+        boundary = (int(now - self.delay) // self.interval + 1) * self.interval
+        return boundary + self.delay
+
+    def sleep_until_next_tick(self):
+        """等待到下一个收盘边界，返回该边界的UTC时间"""
+        now = time.time()
+        tick = self.next_tick(now)
+        time.sleep(max(0.0, tick - now))
+        return datetime.datetime.fromtimestamp(tick - self.delay, tz=timezone.utc)
+
+    def _stop_worker(self, name, timeout=30):
+        process, commands = self.workers.pop(name)
+        if process.is_alive():
+            commands.put(None)
+            process.join(timeout)
+        if process.is_alive():
+            process.terminate()
+            process.join()
+
+    def shutdown(self):
+        """停止所有工作进程"""
+        for name in list(self.workers):
+            self._stop_worker(name)
+        logger.info("调度器已关闭")
@@ -0,0 +1,208 @@
+"""
+下载计划与API开销估算
+
+只通过与实际下载相同的 get_symbols 获取交易对列表(按交易所的上架状态等条件过滤)，
+不发出K线等数据请求
+"""
+import asyncio
+import datetime
+from datetime import timezone
+
+from conf.config import DEFAULT_DOWNLOAD_CONFIG, EXCHANGE_CONFIG
+from db.connection import db_manager
+from exchanges import get_exchange
+from exchanges.base import dataset_start_time, dataset_timeframes, get_window_spec
+from utils.helpers import split_windows, timeframe_to_ms, to_ms
+
+
+async def load_gaps(conn, exchange_id, pair_id, timeframe):
+    """
+    查找序列中尚未确认的缺口，缺口内的K线全部记录在kline_gaps中时视为已确认
+
+    :return: [(缺口首根K线开盘时间, 缺口末根K线开盘时间), ...]，毫秒时间戳
+    """
+    query = """
+            SELECT d.prev_close, d.close
+            FROM (SELECT (extract(epoch FROM close_time) * 1000)::bigint                             AS close,
+                         (extract(epoch FROM lag(close_time) OVER (ORDER BY close_time)) * 1000)::bigint AS prev_close
+                  FROM kline_data
+                  WHERE exchange_id = $1
+                    AND pair_id = $2
+                    AND timeframe = $3) d
+            WHERE d.close - d.prev_close > $4
+              AND (SELECT count(*)
+                   FROM kline_gaps g
+                   WHERE g.exchange_id = $1
+                     AND g.pair_id = $2
+                     AND g.timeframe = $3
+                     AND g.close_time > timestamptz 'epoch' + d.prev_close * interval '1 millisecond'
+                     AND g.close_time < timestamptz 'epoch' + d.close * interval '1 millisecond')
+                < (d.close - d.prev_close) / $4 - 1 \
+            """
+    tf_ms = timeframe_to_ms(timeframe)
+    rows = await conn.fetch(query, exchange_id, pair_id, timeframe, tf_ms)
+    # 缺口为前一根K线之后、后一根K线之前，close_time为开盘时间 + 周期 - 1毫秒
+    return [(row['prev_close'] + 1, row['close'] - 2 * tf_ms + 1) for row in rows]
+
+
+async def load_coverage(exchange_name, timeframes):
+    """
+    从kline_latest读取已入库K线的覆盖范围
+
+    行数加上已确认缺失的K线少于首尾之间的根数时，说明中间有尚未确认的缺口，
+    逐个查出缺口区间，只重新下载缺口而不是整段
+
+    :return: {(symbol, timeframe): (首根K线开盘时间, 末根K线开盘时间, [未确认的缺口区间])}，毫秒时间戳
+    """
+    async with db_manager.acquire() as conn:
+        query = """
+                SELECT tp.symbol,
+                       kl.exchange_id,
+                       kl.pair_id,
+                       kl.timeframe,
+                       kl.row_count,
+                       (extract(epoch FROM kl.first_close_time) * 1000)::bigint AS first_close,
+                       (extract(epoch FROM kl.last_close_time) * 1000)::bigint  AS last_close,
+                       (SELECT count(*)
+                        FROM kline_gaps g
+                        WHERE g.exchange_id = kl.exchange_id
+                          AND g.pair_id = kl.pair_id
+                          AND g.timeframe = kl.timeframe
+                          AND g.close_time BETWEEN kl.first_close_time AND kl.last_close_time) AS known_gaps
+                FROM kline_latest kl
+                         JOIN exchanges e ON e.exchange_id = kl.exchange_id
+                         JOIN trading_pairs tp ON tp.pair_id = kl.pair_id
+                WHERE e.exchange_name = $1
+                  AND kl.timeframe = ANY ($2) \
+                """
+        rows = await conn.fetch(query, exchange_name, list(timeframes))
+
+        coverage = {}
+        for row in rows:
+            tf_ms = timeframe_to_ms(row['timeframe'])
+            gaps = []
+            if row['row_count'] + row['known_gaps'] < (row['last_close'] - row['first_close']) // tf_ms + 1:
+                gaps = await load_gaps(conn, row['exchange_id'], row['pair_id'], row['timeframe'])
+            # close_time为开盘时间 + 周期 - 1毫秒
+            offset = tf_ms - 1
+            coverage[(row['symbol'], row['timeframe'])] = (row['first_close'] - offset,
+                                                           row['last_close'] - offset, gaps)
+    return coverage
+
+
+def missing_ranges(start_ts, end_ts, covered, timeframe):
+    """[start_ts, end_ts]中在covered首尾之外的区间，中间的缺口见 gap_ranges"""
+    if covered is None:
+        return [(start_ts, end_ts)]
+
+    first_open, last_open = covered[:2]
+    tf_ms = timeframe_to_ms(timeframe)
+    ranges = []
+    if start_ts < first_open:
+        ranges.append((start_ts, min(end_ts, first_open - 1)))
+    if end_ts > last_open + tf_ms - 1:
+        ranges.append((max(start_ts, last_open + tf_ms), end_ts))
+    return [(s, e) for s, e in ranges if s <= e]
+
+
+def gap_ranges(start_ts, end_ts, covered):
+    """covered中与[start_ts, end_ts]相交的未确认缺口，应进入repair通道重新下载"""
+    if covered is None:
+        return []
+    ranges = [(max(start_ts, gap_start), min(end_ts, gap_end)) for gap_start, gap_end in covered[2]]
+    return [(s, e) for s, e in ranges if s <= e]
+
+
+def plan_exchange(exchange_name, symbols_dict, coverage, config):
+    """
+    估算单个交易所的下载开销
+
+    :return: {'windows', 'requests', 'weight', 'rows', 'seconds', 'tasks'}
+    """
+    exchange_config = EXCHANGE_CONFIG[exchange_name]
+    market_types = config.get('market_types', DEFAULT_DOWNLOAD_CONFIG['market_types'])
+    timeframes = config.get('timeframes', [DEFAULT_DOWNLOAD_CONFIG['timeframe']])
+    start_ts = to_ms(config.get('start_time', datetime.datetime(2023, 1, 1, tzinfo=timezone.utc)))
+    end_ts = to_ms(config.get('end_time', datetime.datetime.now(timezone.utc)))
+    datasets = config.get('datasets', ['klines'])
+    mode = config.get('mode', 'all')
+
+    summary = {'tasks': 0, 'windows': 0, 'requests': 0, 'weight': 0, 'rows': 0}
+
+    if mode != 'latest':
+        # get_symbols 对现货和永续合约各请求一次，与market_types无关
+        for weight in exchange_config['symbols_weight'].values():
+            summary['requests'] += 1
+            summary['weight'] += weight
+
+    for market_type in market_types:
+        # 批量行情每个市场一次请求，刷新最新行情和按成交额排序交易对共用
+        summary['requests'] += 1
+        summary['weight'] += exchange_config['ticker_weight'][market_type]
+        if mode == 'latest':
+            continue
+
+        symbol_key = 'perpetual' if market_type == 'futures' else market_type
+
+        for symbol in symbols_dict.get(symbol_key, []):
+            pair = f"{symbol}/USDT"
+            for dataset in datasets:
+                for timeframe in dataset_timeframes(dataset, timeframes):
+                    spec = get_window_spec(exchange_config, dataset, market_type, timeframe)
+                    if spec is None:
+                        continue
+                    bars_per_window, request_weight = spec
+                    summary['tasks'] += 1
+                    # 资金费率按结算间隔估算行数，其余数据集每个周期一行
+                    interval_hours = exchange_config['datasets'].get(dataset, {}).get('interval_hours')
+                    tf_ms = interval_hours * 3600 * 1000 if interval_hours else timeframe_to_ms(timeframe)
+                    covered = coverage.get((pair, timeframe)) if dataset == 'klines' else None
+                    series_start = dataset_start_time(exchange_config, dataset, start_ts)
+                    ranges = missing_ranges(series_start, end_ts, covered, timeframe)
+                    ranges += gap_ranges(series_start, end_ts, covered)
+                    for range_start, range_end in ranges:
+                        windows = len(split_windows(range_start, range_end, timeframe, bars_per_window))
+                        summary['windows'] += windows
+                        summary['requests'] += windows
+                        summary['weight'] += windows * request_weight
+                        summary['rows'] += (range_end - range_start) // tf_ms + 1
+
+    summary['seconds'] = summary['weight'] / exchange_config['rate_limit']['weight_per_second']
+    return summary
+
+
+async def plan_download(config, use_coverage=True):
+    """
+    展开下载配置并估算各交易所的请求数、权重、写入行数和耗时
+
+    :return: {exchange_name: summary}
+    """
+    exchanges = config.get('exchanges', DEFAULT_DOWNLOAD_CONFIG['exchanges'])
+    timeframes = config.get('timeframes', [DEFAULT_DOWNLOAD_CONFIG['timeframe']])
+    plan = {}
+
+    db_manager.configure(concurrency=1)
+    await db_manager.create_pool()
+    try:
+        for exchange_name in exchanges:
+            # 与实际下载使用相同的交易对列表
+            symbols_dict = await asyncio.to_thread(get_exchange(exchange_name).get_symbols)
+            coverage = await load_coverage(exchange_name, timeframes) if use_coverage else {}
+            plan[exchange_name] = plan_exchange(exchange_name, symbols_dict, coverage, config)
+            plan[exchange_name]['symbols'] = sum(len(v) for v in symbols_dict.values())
+    finally:
+        await db_manager.close_pool()
+    return plan
+
+
+def format_plan(plan):
+    """格式化下载计划"""
+    lines = [f"{'交易所':<10}{'交易对':>8}{'任务':>10}{'窗口':>12}{'请求':>12}{'权重':>14}{'写入行数':>16}{'预计耗时':>12}"]
+    for exchange_name, s in plan.items():
+        duration = datetime.timedelta(seconds=int(s['seconds']))
+        lines.append(f"{exchange_name:<10}{s['symbols']:>8}{s['tasks']:>10}{s['windows']:>12}"
+                     f"{s['requests']:>12}{s['weight']:>14}{s['rows']:>16}{str(duration):>12}")
+    # 各交易所并行下载，总耗时取最长者
+    total_seconds = max((s['seconds'] for s in plan.values()), default=0)
+    lines.append(f"预计总耗时: {datetime.timedelta(seconds=int(total_seconds))}")
+    return '\n'.join(lines)
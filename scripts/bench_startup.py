@@ -0,0 +1,113 @@
+# /root/exchange/.venv/bin/python3 -m scripts.bench_startup --repeat 5
+"""
+启动耗时基准
+
+在新进程中用 -X importtime 导入各入口模块，统计累计导入耗时并与预算比较；
+子进程在临时目录中运行，同时检查导入过程没有创建文件(如日志文件)。
+任一模块超出预算或有副作用时返回非0，可用于CI。
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+# 入口模块 -> 导入耗时预算(毫秒)
+BUDGETS = {
+    'utils': 40,
+    'exchanges': 40,
+    'planner': 250,
+    'scripts.query': 250,
+    'orchestrator': 250,
+    'worker': 250,
+    'main': 300,
+}
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_importtime(output):
+    """
+    解析 -X importtime 的输出
+
+    :return: [(模块名, 嵌套层级, 自身耗时微秒, 累计耗时微秒), ...]，子模块排在导入它的模块之前
+    """
+    result = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue
+        name = parts[2].rstrip()
+        result.append((name.strip(), len(name) - len(name.lstrip()), int(parts[0]), int(parts[1])))
+    return result
+
+
+def module_subtree(entries, module):
+    """模块本身及其导入的全部子模块(不含解释器启动时的导入)"""
+    for i, (name, level, _, _) in enumerate(entries):
+        if name == module:
+            start = i
+            while start > 0 and entries[start - 1][1] > level:
+                start -= 1
+            return entries[start:i + 1]
+    return []
+
+
+def measure(module):
+    """
+    在新进程中导入模块
+
+    :return: (累计导入耗时毫秒, 自身耗时最多的模块, 导入后新建的文件)
+    """
+    env = dict(os.environ, PYTHONPATH=PROJECT_ROOT)
+    with tempfile.TemporaryDirectory() as cwd:
+        completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                                   cwd=cwd, env=env, capture_output=True, text=True)
+        created = os.listdir(cwd)
+
+    if completed.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{completed.stderr.strip().splitlines()[-1]}")
+
+    subtree = module_subtree(parse_importtime(completed.stderr), module)
+    cumulative = subtree[-1][3] if subtree else 0
+    slowest = sorted(subtree, key=lambda entry: entry[2], reverse=True)[:5]
+    return cumulative / 1000, slowest, created
+
+
+def run_benchmark(modules, repeat=3):
+    """逐个模块测量repeat次取最小值，返回是否全部满足预算"""
+    ok = True
+    print(f"{'模块':<16}{'耗时(ms)':>10}{'预算(ms)':>10}  自身耗时最多的模块")
+    for module in modules:
+        try:
+            runs = [measure(module) for _ in range(repeat)]
+        except RuntimeError as e:
+            print(str(e))
+            ok = False
+            continue
+
+        elapsed, slowest, created = min(runs, key=lambda run: run[0])
+        budget = BUDGETS.get(module)
+        status = '' if budget is None or elapsed <= budget else '  超出预算'
+        top = ', '.join(f"{name}({own / 1000:.1f})" for name, _, own, _ in slowest)
+        print(f"{module:<16}{elapsed:>10.1f}{budget if budget is not None else '-':>10}  {top}{status}")
+        if status:
+            ok = False
+        if created:
+            print(f"{module} 导入时创建了文件: {', '.join(created)}")
+            ok = False
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='入口模块导入耗时基准')
+    parser.add_argument('modules', nargs='*', default=list(BUDGETS), help='要测量的模块，默认为全部入口')
+    parser.add_argument('--repeat', type=int, default=3, help='每个模块测量次数，取最小值')
+    args = parser.parse_args()
+    sys.exit(0 if run_benchmark(args.modules, args.repeat) else 1)
+
+
+if __name__ == '__main__':
+    main()
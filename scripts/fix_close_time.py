@@ -0,0 +1,84 @@
+# /root/exchange/.venv/bin/python3 -m scripts.fix_close_time --timezone Asia/Shanghai
+"""
+修正历史K线的close_time(只需执行一次)
+
+旧版本把K线开盘时间按主机本地时区转换后写入close_time，
+本脚本将其改为UTC收盘时间(开盘时间 + 周期 - 1毫秒)，与当前写入逻辑一致。
+旧数据的close_time为整秒，修正后以999毫秒结尾，只更新整秒的行，重复执行不会再次偏移。
+本地时间按时区名称换算(AT TIME ZONE)，夏令时和非整点时区也能正确处理。
+
+新版本部署后已经按UTC写入的K线与旧数据重复时，删除重复的旧数据，不再更新主键。
+"""
+import argparse
+import asyncio
+
+from db.connection import db_manager
+from utils.helpers import TIMEFRAME_MS
+
+# 需要修正的旧数据: 指定周期(和交易所)且close_time为整秒
+LEGACY_ROWS = """
+    e.exchange_id = kd.exchange_id
+    AND kd.timeframe = $1
+    AND ($4::text IS NULL OR e.exchange_name = $4)
+    AND kd.close_time = date_trunc('second', kd.close_time)
+"""
+
+# 旧数据对应的UTC收盘时间: 先还原为本地时间，再按时区换算为UTC
+CORRECTED_CLOSE_TIME = """
+    ((kd.close_time AT TIME ZONE 'UTC') AT TIME ZONE $2) + ($3 - 1) * interval '1 millisecond'
+"""
+
+
+async def fix_close_time(tz_name, exchange_name=None):
+    """
+    :param tz_name: 写入旧数据的主机时区，如 Asia/Shanghai
+    :param exchange_name: 只修正指定交易所，None表示全部
+    :return: {timeframe: (修正行数, 删除的重复行数)}
+    """
+    result = {}
+    try:
+        db_manager.configure(concurrency=1)
+        await db_manager.create_pool()
+        async with db_manager.acquire() as conn:
+            async with conn.transaction():
+                for timeframe, timeframe_ms in TIMEFRAME_MS.items():
+                    # 已有修正后的同一根K线时删除旧数据，否则更新主键会违反唯一约束
+                    delete_query = f"""
+                                   DELETE FROM kline_data kd
+                                   USING exchanges e
+                                   WHERE {LEGACY_ROWS}
+                                     AND EXISTS (SELECT 1
+                                                 FROM kline_data dup
+                                                 WHERE dup.exchange_id = kd.exchange_id
+                                                   AND dup.pair_id = kd.pair_id
+                                                   AND dup.timeframe = kd.timeframe
+                                                   AND dup.close_time = {CORRECTED_CLOSE_TIME}) \
+                                   """
+                    status = await conn.execute(delete_query, timeframe, tz_name, timeframe_ms, exchange_name)
+                    deleted = int(status.split()[-1])
+
+                    update_query = f"""
+                                   UPDATE kline_data kd
+                                   SET close_time = {CORRECTED_CLOSE_TIME}
+                                   FROM exchanges e
+                                   WHERE {LEGACY_ROWS} \
+                                   """
+                    status = await conn.execute(update_query, timeframe, tz_name, timeframe_ms, exchange_name)
+                    result[timeframe] = (int(status.split()[-1]), deleted)
+                    print(f"{timeframe} 已修正 {result[timeframe][0]} 条数据，删除 {deleted} 条重复的旧数据")
+    finally:
+        await db_manager.close_pool()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='修正历史K线的close_time')
+    parser.add_argument('--timezone', required=True,
+                        help='写入旧数据的主机时区名称，如 Asia/Shanghai')
+    parser.add_argument('--exchange', default=None, help='只修正指定交易所')
+    args = parser.parse_args()
+    asyncio.run(fix_close_time(args.timezone, args.exchange))
+
+
+if __name__ == '__main__':
+    main()
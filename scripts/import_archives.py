@@ -0,0 +1,232 @@
+# /root/exchange/.venv/bin/python3 -m scripts.import_archives /data/binance/data --processes 8
+"""
+从Binance历史数据归档(data.binance.vision的月度/日度K线zip)批量导入K线
+
+目录结构与官方一致，例如:
+    data/spot/monthly/klines/BTCUSDT/1h/BTCUSDT-1h-2024-01.zip
+    data/futures/um/daily/klines/BTCUSDT/1m/BTCUSDT-1m-2024-02-01.zip
+同目录下的 .CHECKSUM 文件用于校验zip的sha256。完全离线运行，REST只需补齐最近几天。
+
+zip中的CSV以文本流式COPY进数据库，表头、类型转换和微秒时间戳在SQL中处理，
+不在Python中逐行解析。
+"""
+import argparse
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import re
+import zipfile
+
+from db import models
+from db.connection import db_manager
+from utils.helpers import TIMEFRAME_MS
+
+# 归档文件名: BTCUSDT-1h-2024-01.zip / BTCUSDT-1h-2024-01-01.zip
+ARCHIVE_PATTERN = re.compile(r'^(?P<symbol>[A-Z0-9]+)-(?P<interval>\w+)-(?P<date>\d{4}-\d{2}(?:-\d{2})?)\.zip$')
+
+# 按长度从长到短匹配的计价资产
+QUOTE_ASSETS = ('FDUSD', 'USDT', 'USDC', 'BUSD', 'BTC', 'ETH', 'BNB')
+
+# 归档CSV的列
+ARCHIVE_COLUMNS = (
+    'open_time', 'open', 'high', 'low', 'close', 'volume', 'close_time', 'quote_volume',
+    'trade_num', 'taker_buy_base_asset_volume', 'taker_buy_quote_asset_volume', 'ignore',
+)
+
+# 大于该值的时间戳为微秒(2025年起的现货归档)
+MICROSECOND_THRESHOLD = 10 ** 14
+
+# 数据行的open_time只含数字，不匹配的行(表头)在SQL中跳过
+DATA_ROW_PATTERN = r'^[0-9]+$'
+
+
+def parse_archive_path(path, market_type=None):
+    """
+    解析归档文件路径
+
+    :return: {'path', 'symbol', 'timeframe', 'market_type'}，无法识别时返回None
+    """
+    match = ARCHIVE_PATTERN.match(os.path.basename(path))
+    if not match or match.group('interval') not in TIMEFRAME_MS:
+        return None
+
+    raw_symbol = match.group('symbol')
+    quote = next((q for q in QUOTE_ASSETS if raw_symbol.endswith(q) and len(raw_symbol) > len(q)), None)
+    if quote is None:
+        return None
+
+    if market_type is None:
+        parts = os.path.normpath(path).split(os.sep)
+        market_type = 'futures' if 'futures' in parts else 'spot'
+
+    return {
+        'path': path,
+        'symbol': f"{raw_symbol[:-len(quote)]}/{quote}",
+        'timeframe': match.group('interval'),
+        'market_type': market_type,
+    }
+
+
+def find_archives(root, market_type=None):
+    """递归查找目录下的全部K线归档"""
+    archives = []
+    for dirpath, _, filenames in os.walk(root):
+        for filename in sorted(filenames):
+            archive = parse_archive_path(os.path.join(dirpath, filename), market_type)
+            if archive:
+                archives.append(archive)
+    return archives
+
+
+def verify_checksum(path, require=False):
+    """
+    校验zip文件的sha256
+
+    :return: 校验通过或(非强制时)没有校验文件返回True
+    """
+    checksum_path = f"{path}.CHECKSUM"
+    if not os.path.exists(checksum_path):
+        return not require
+
+    with open(checksum_path) as f:
+        expected = f.read().split()[0].lower()
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest() == expected
+
+
+async def copy_archive_member(conn, exchange_id, pair_id, timeframe, source):
+    """
+    将zip中的一个CSV文件写入kline_data，需在事务中调用
+
+    CSV原样COPY进文本列的暂存表，再在SQL中跳过表头(新版期货归档带表头)、
+    转换类型并将微秒时间戳换算为毫秒，最后与REST下载共用 merge_kline_stage 写入
+
+    :param source: CSV文件对象，由asyncpg分块读取
+    :return: 实际新增的行数
+    """
+    column_defs = ', '.join(f"{column} TEXT" for column in ARCHIVE_COLUMNS)
+    await conn.execute(f"CREATE TEMP TABLE kline_archive_raw ({column_defs}) ON COMMIT DROP")
+    await conn.copy_to_table('kline_archive_raw', source=source, columns=ARCHIVE_COLUMNS, format='csv')
+
+    await models.create_kline_stage(conn)
+    await conn.execute(f"""
+                       INSERT INTO kline_stage
+                       ({', '.join(models.KLINE_STAGE_COLUMNS)})
+                       SELECT CASE
+                                  WHEN open_time::bigint > {MICROSECOND_THRESHOLD} THEN open_time::bigint / 1000
+                                  ELSE open_time::bigint END,
+                              open::float8,
+                              high::float8,
+                              low::float8,
+                              close::float8,
+                              volume::float8,
+                              quote_volume::float8,
+                              trade_num::bigint,
+                              taker_buy_base_asset_volume::float8,
+                              taker_buy_quote_asset_volume::float8
+                       FROM kline_archive_raw
+                       WHERE open_time ~ '{DATA_ROW_PATTERN}' \
+                       """)
+    # 同一事务内可多次调用
+    await conn.execute("DROP TABLE kline_archive_raw")
+    return await models.merge_kline_stage(conn, exchange_id, pair_id, timeframe)
+
+
+async def import_archive(exchange_id, archive, require_checksum=False):
+    """导入单个归档文件，返回新增行数"""
+    path = archive['path']
+    if not verify_checksum(path, require_checksum):
+        print(f"校验失败，跳过: {path}")
+        return 0
+
+    base_asset, quote_asset = archive['symbol'].split('/')
+    pair_id = await models.get_pair_id(exchange_id, archive['symbol'], archive['market_type'],
+                                       base_asset, quote_asset)
+
+    inserted = 0
+    with zipfile.ZipFile(path) as zf:
+        async with db_manager.acquire() as conn:
+            async with conn.transaction():
+                for member in zf.namelist():
+                    if not member.endswith('.csv'):
+                        continue
+                    with zf.open(member) as source:
+                        inserted += await copy_archive_member(conn, exchange_id, pair_id,
+                                                              archive['timeframe'], source)
+    return inserted
+
+
+async def import_archives(archives, exchange_name='binance', require_checksum=False, process_count=1):
+    """
+    在当前进程中顺序导入一组归档，返回 (文件数, 新增行数)
+
+    :param process_count: 并行导入的进程数，各进程平分全局连接预算
+    """
+    total = 0
+    # 顺序导入，同一时间只使用一个连接
+    db_manager.configure(concurrency=1, process_count=process_count)
+    try:
+        await db_manager.create_pool()
+        exchange_id = await models.get_exchange_id(exchange_name)
+        if not exchange_id:
+            return 0, 0
+
+        for archive in archives:
+            try:
+                inserted = await import_archive(exchange_id, archive, require_checksum)
+                total += inserted
+                print(f"{archive['path']} 导入 {inserted} 条数据")
+            except Exception as e:
+                print(f"导入 {archive['path']} 时发生错误: {str(e)}")
+    finally:
+        await db_manager.close_pool()
+    return len(archives), total
+
+
+def _import_worker(args):
+    """进程池入口"""
+    archives, exchange_name, require_checksum, process_count = args
+    return asyncio.run(import_archives(archives, exchange_name, require_checksum, process_count))
+
+
+def run_import(root, exchange_name='binance', market_type=None, processes=None, require_checksum=False):
+    """多进程导入目录下的全部归档"""
+    archives = find_archives(root, market_type)
+    if not archives:
+        print(f"{root} 下没有找到K线归档")
+        return 0
+
+    processes = min(processes or multiprocessing.cpu_count(), len(archives))
+    # 按文件大小轮流分配，各进程负载接近
+    archives.sort(key=lambda a: os.path.getsize(a['path']), reverse=True)
+    groups = [archives[i::processes] for i in range(processes)]
+    print(f"共 {len(archives)} 个归档，使用 {processes} 个进程导入")
+
+    with multiprocessing.Pool(processes=processes) as pool:
+        results = pool.map(_import_worker, [(group, exchange_name, require_checksum, processes)
+                                            for group in groups])
+
+    total = sum(inserted for _, inserted in results)
+    print(f"导入完成，共新增 {total} 条数据")
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='从Binance历史数据归档导入K线')
+    parser.add_argument('root', help='归档所在目录')
+    parser.add_argument('--exchange', default='binance', help='交易所名称')
+    parser.add_argument('--market-type', choices=['spot', 'futures'], default=None,
+                        help='市场类型，默认按路径中是否含futures判断')
+    parser.add_argument('--processes', type=int, default=None, help='并行进程数，默认为CPU核心数')
+    parser.add_argument('--require-checksum', action='store_true', help='缺少CHECKSUM文件时跳过该归档')
+    args = parser.parse_args()
+    run_import(args.root, args.exchange, args.market_type, args.processes, args.require_checksum)
+
+
+if __name__ == '__main__':
+    main()
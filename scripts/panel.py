@@ -0,0 +1,158 @@
+# /root/exchange/.venv/bin/python3 -m scripts.panel
+"""
+跨交易所对齐的K线面板，用于研究场景批量加载
+
+一次SQL查询按二进制COPY导出 (列号, 行号, 字段...)，再用NumPy向量化写入
+时间 × 品种 的稠密矩阵，缺失的K线为NaN，不经过逐行的Python对象。
+
+NumPy只是研究脚本的可选依赖，下载和写入流程不依赖NumPy。
+"""
+import asyncio
+import io
+from datetime import datetime, timezone
+
+import numpy as np
+
+from db.connection import db_manager
+from utils.helpers import timeframe_to_ms, to_ms
+
+PANEL_FIELDS = (
+    'open', 'high', 'low', 'close', 'volume', 'quote_volume', 'trade_num',
+    'taker_buy_base_asset_volume', 'taker_buy_quote_asset_volume',
+)
+
+# PGCOPY二进制格式: 11字节签名 + 4字节标志 + 4字节扩展头长度
+COPY_HEADER_SIZE = 19
+
+
+def _record_dtype(fields):
+    """二进制COPY每行的结构: 字段数(int16)，之后每个字段为 长度(int32) + 值，均为大端"""
+    layout = [('field_count', '>i2'), ('col_len', '>i4'), ('col', '>i4'), ('row_len', '>i4'), ('row', '>i4')]
+    for field in fields:
+        layout += [(f'{field}_len', '>i4'), (field, '>f8')]
+    return np.dtype(layout)
+
+
+async def load_instruments(conn, symbols, exchanges, market_types):
+    """
+    按 交易所、市场类型、交易对 的顺序解析面板的列
+
+    trading_pairs 按(交易所, 交易对)唯一，市场类型以该表中的记录为准
+
+    :return: [(exchange_name, market_type, symbol, exchange_id, pair_id), ...]
+    """
+    query = """
+            SELECT e.exchange_name, tp.market_type, tp.symbol, e.exchange_id, tp.pair_id
+            FROM trading_pairs tp
+                     JOIN exchanges e ON e.exchange_id = tp.exchange_id
+            WHERE e.exchange_name = ANY ($1::text[])
+              AND tp.market_type = ANY ($2::text[])
+              AND tp.symbol = ANY ($3::text[])
+            ORDER BY array_position($1::text[], e.exchange_name::text),
+                     array_position($2::text[], tp.market_type::text),
+                     tp.symbol \
+            """
+    rows = await conn.fetch(query, list(exchanges), list(market_types), list(symbols))
+    return [tuple(row) for row in rows]
+
+
+async def load_panel(symbols, exchanges, market_types, timeframe, start_time, end_time, fields=('close',)):
+    """
+    加载对齐后的K线面板
+
+    :param symbols: 交易对列表，如 ['BTC/USDT', 'ETH/USDT']
+    :param exchanges: 交易所列表
+    :param market_types: 市场类型列表
+    :param timeframe: 时间周期
+    :param start_time: 开始时间 (UTC datetime 对象或毫秒时间戳)
+    :param end_time: 结束时间 (UTC datetime 对象或毫秒时间戳)
+    :param fields: 需要加载的字段，见 PANEL_FIELDS
+    :return: {'timestamps': 各行K线开盘时间(毫秒, int64),
+              'instruments': [(exchange_name, market_type, symbol), ...],
+              field: float64矩阵 [len(timestamps), len(instruments)]，缺失为NaN}
+    """
+    unknown = set(fields) - set(PANEL_FIELDS)
+    if unknown:
+        raise ValueError(f"不支持的字段: {', '.join(sorted(unknown))}")
+
+    tf_ms = timeframe_to_ms(timeframe)
+    # 首行对齐到周期边界
+    first_open = -(-to_ms(start_time) // tf_ms) * tf_ms
+    end_ts = to_ms(end_time)
+    row_count = max(0, (end_ts - first_open) // tf_ms + 1)
+    timestamps = first_open + np.arange(row_count, dtype=np.int64) * tf_ms
+
+    db_manager.configure(concurrency=1)
+    await db_manager.create_pool()
+    try:
+        async with db_manager.acquire() as conn:
+            instruments = await load_instruments(conn, symbols, exchanges, market_types)
+            panel = {
+                'timestamps': timestamps,
+                'instruments': [instrument[:3] for instrument in instruments],
+            }
+            for field in fields:
+                panel[field] = np.full((row_count, len(instruments)), np.nan)
+            if not instruments or not row_count:
+                return panel
+
+            columns = ', '.join(f"coalesce(kd.{field}::float8, 'NaN')" for field in fields)
+            query = f"""
+                    SELECT (i.col - 1)::int4,
+                           (((extract(epoch FROM kd.close_time) * 1000)::bigint + 1 - $4 - $5) / $4)::int4,
+                           {columns}
+                    FROM unnest($1::int[], $2::int[]) WITH ORDINALITY AS i(exchange_id, pair_id, col)
+                             JOIN kline_data kd
+                                  ON kd.exchange_id = i.exchange_id
+                                      AND kd.pair_id = i.pair_id
+                                      AND kd.timeframe = $3
+                    WHERE kd.close_time >= timestamptz 'epoch' + ($5::bigint + $4 - 1) * interval '1 millisecond'
+                      AND kd.close_time <= timestamptz 'epoch' + ($6::bigint + $4 - 1) * interval '1 millisecond' \
+                    """
+            buffer = io.BytesIO()
+            await conn.copy_from_query(
+                query,
+                [instrument[3] for instrument in instruments],
+                [instrument[4] for instrument in instruments],
+                timeframe, tf_ms, first_open, int(timestamps[-1]),
+                output=buffer,
+                format='binary',
+            )
+    finally:
+        await db_manager.close_pool()
+
+    dtype = _record_dtype(fields)
+    data = buffer.getbuffer()
+    # 末尾2字节为结束标记
+    count = (len(data) - COPY_HEADER_SIZE - 2) // dtype.itemsize
+    records = np.frombuffer(data, dtype=dtype, count=count, offset=COPY_HEADER_SIZE)
+    rows = records['row'].astype(np.intp)
+    cols = records['col'].astype(np.intp)
+    for field in fields:
+        panel[field][rows, cols] = records[field]
+    return panel
+
+
+async def main():
+    # 示例: 三个交易所BTC、ETH的1h收盘价
+    start_time = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    end_time = datetime(2025, 2, 1, tzinfo=timezone.utc)
+
+    panel = await load_panel(
+        symbols=['BTC/USDT', 'ETH/USDT'],
+        exchanges=['binance', 'okex', 'bybit'],
+        market_types=['spot', 'futures'],
+        timeframe='1h',
+        start_time=start_time,
+        end_time=end_time,
+        fields=('close', 'volume'),
+    )
+
+    print(f"{len(panel['timestamps'])} 行 × {len(panel['instruments'])} 列")
+    for col, instrument in enumerate(panel['instruments']):
+        missing = int(np.isnan(panel['close'][:, col]).sum())
+        print(f"{instrument} 缺失 {missing} 根K线")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
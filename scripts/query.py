@@ -15,7 +15,7 @@ async def query_kline_data(exchange_name, timeframe, start_time, end_time):
     """
     try:
         await db_manager.create_pool()
-        async with db_manager.pool.acquire() as conn:
+        async with db_manager.acquire() as conn:
             query = """
                     select *
                     from exchanges e,
@@ -42,10 +42,45 @@ async def query_kline_data(exchange_name, timeframe, start_time, end_time):
     finally:
         await db_manager.close_pool()
 
+async def query_kline_latest(exchange_name, timeframe, stale_before=None):
+    """
+    查询各交易对的最新K线和覆盖范围(读取kline_latest，不扫描kline_data)
+
+    :param exchange_name: 交易所名称
+    :param timeframe: 时间周期
+    :param stale_before: 只返回最新收盘时间早于该时间的序列 (UTC datetime 对象)，None表示全部
+    :return: 查询结果列表
+    """
+    try:
+        await db_manager.create_pool()
+        async with db_manager.acquire() as conn:
+            query = """
+                    select tp.symbol,
+                           kl.first_close_time,
+                           kl.last_close_time,
+                           kl.row_count,
+                           kl.last_close,
+                           kl.updated_at
+                    from kline_latest kl
+                             join exchanges e on e.exchange_id = kl.exchange_id
+                             join trading_pairs tp on tp.pair_id = kl.pair_id
+                    where e.exchange_name = $1
+                      and kl.timeframe = $2
+                      and ($3::timestamptz is null or kl.last_close_time < $3)
+                    order by kl.last_close_time;
+                    """
+            rows = await conn.fetch(query, exchange_name, timeframe, stale_before)
+            return rows
+    except Exception as e:
+        print(f"查询数据时发生错误: {str(e)}")
+        return []
+    finally:
+        await db_manager.close_pool()
+
 async def main():
     # 示例查询
-    start_time = datetime.strptime("2025-05-18 00:00:00", "%Y-%m-%d %H:%M:%S")
-    end_time = datetime.strptime("2025-05-19 00:00:00", "%Y-%m-%d %H:%M:%S")
+    start_time = datetime.strptime("2025-05-18 00:00:00", "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+    end_time = datetime.strptime("2025-05-19 00:00:00", "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
     
     results = await query_kline_data(
         exchange_name='binance',
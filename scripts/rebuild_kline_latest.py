@@ -0,0 +1,49 @@
+# /root/exchange/.venv/bin/python3 -m scripts.rebuild_kline_latest
+"""
+按kline_data全量重建kline_latest覆盖表
+
+kline_latest 随每批K线写入增量维护，只在首次建表(已有历史K线)、
+执行 fix_close_time 或手工修改/删除K线之后需要重建一次。
+"""
+import argparse
+import asyncio
+
+from db import models
+from db.connection import db_manager
+from db.schema import ensure_schema
+
+
+async def rebuild_kline_latest(exchange_name=None):
+    """
+    :param exchange_name: 只重建指定交易所，None表示全部
+    :return: 重建的序列数
+    """
+    try:
+        db_manager.configure(concurrency=1)
+        await db_manager.create_pool()
+        await ensure_schema()
+
+        exchange_id = None
+        if exchange_name:
+            exchange_id = await models.get_exchange_id(exchange_name)
+            if not exchange_id:
+                return 0
+
+        async with db_manager.acquire() as conn:
+            async with conn.transaction():
+                count = await models.rebuild_kline_latest(conn, exchange_id)
+        print(f"已重建 {count} 个序列的覆盖范围")
+        return count
+    finally:
+        await db_manager.close_pool()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='按kline_data重建kline_latest覆盖表')
+    parser.add_argument('--exchange', default=None, help='只重建指定交易所')
+    args = parser.parse_args()
+    asyncio.run(rebuild_kline_latest(args.exchange))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""归档导入的离线测试，使用临时目录中生成的小zip归档，不连接数据库"""
+import asyncio
+import csv
+import hashlib
+import io
+import os
+import re
+import sys
+import types
+import zipfile
+
+import pytest
+
+try:
+    import asyncpg  # noqa: F401
+except ImportError:
+    # 这里只测试不访问数据库的部分，没有安装asyncpg时用空模块代替
+    sys.modules['asyncpg'] = types.SimpleNamespace(Connection=object)
+
+from scripts import import_archives  # noqa: E402
+
+# 2024-01-01 00:00 UTC
+OPEN_TIME_MS = 1704067200000
+HOUR_MS = 60 * 60 * 1000
+
+FUTURES_HEADER = ','.join(import_archives.ARCHIVE_COLUMNS)
+
+
+def kline_row(open_time, close_time):
+    return [open_time, '42000.1', '42100.0', '41900.5', '42050.0', '12.5', close_time,
+            '525000.0', '310', '6.1', '256000.0', '0']
+
+
+def write_archive(path, rows, header=None):
+    """生成只含一个CSV的K线归档，并写入对应的CHECKSUM文件"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    buf = io.StringIO()
+    if header:
+        buf.write(header + '\n')
+    csv.writer(buf, lineterminator='\n').writerows(rows)
+    member = os.path.basename(path)[:-len('.zip')] + '.csv'
+    with zipfile.ZipFile(path, 'w') as zf:
+        zf.writestr(member, buf.getvalue())
+    with open(path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    with open(f"{path}.CHECKSUM", 'w') as f:
+        f.write(f"{digest}  {os.path.basename(path)}\n")
+    return path
+
+
+@pytest.fixture
+def futures_archive(tmp_path):
+    """带表头、毫秒时间戳的期货日度归档"""
+    path = tmp_path / 'data' / 'futures' / 'um' / 'daily' / 'klines' / 'BTCUSDT' / '1h' / 'BTCUSDT-1h-2024-01-01.zip'
+    rows = [kline_row(OPEN_TIME_MS + i * HOUR_MS, OPEN_TIME_MS + (i + 1) * HOUR_MS - 1) for i in range(2)]
+    return write_archive(str(path), rows, header=FUTURES_HEADER)
+
+
+@pytest.fixture
+def spot_archive(tmp_path):
+    """不带表头、微秒时间戳的现货月度归档"""
+    path = tmp_path / 'data' / 'spot' / 'monthly' / 'klines' / 'ETHFDUSD' / '1h' / 'ETHFDUSD-1h-2025-01.zip'
+    rows = [kline_row((OPEN_TIME_MS + i * HOUR_MS) * 1000, (OPEN_TIME_MS + (i + 1) * HOUR_MS) * 1000 - 1)
+            for i in range(2)]
+    return write_archive(str(path), rows)
+
+
+def read_member_rows(path):
+    with zipfile.ZipFile(path) as zf:
+        with zf.open(zf.namelist()[0]) as f:
+            return list(csv.reader(io.TextIOWrapper(f)))
+
+
+def test_parse_archive_path(futures_archive, spot_archive):
+    assert import_archives.parse_archive_path(futures_archive) == {
+        'path': futures_archive, 'symbol': 'BTC/USDT', 'timeframe': '1h', 'market_type': 'futures',
+    }
+    # 按从长到短匹配计价资产，FDUSD不能被识别为USD
+    parsed = import_archives.parse_archive_path(spot_archive)
+    assert (parsed['symbol'], parsed['market_type']) == ('ETH/FDUSD', 'spot')
+    # 显式指定的市场类型优先于路径
+    assert import_archives.parse_archive_path(spot_archive, 'futures')['market_type'] == 'futures'
+
+
+@pytest.mark.parametrize('name', [
+    'BTCUSDT-3h-2024-01.zip',  # 不支持的周期
+    'BTCUSDT-1h-2024-01.zip.CHECKSUM',
+    'USDT-1h-2024-01.zip',  # 只有计价资产
+    'BTCXYZ-1h-2024-01.zip',  # 未知的计价资产
+])
+def test_parse_archive_path_rejects(name):
+    assert import_archives.parse_archive_path(os.path.join('data', 'spot', name)) is None
+
+
+def test_find_archives_skips_checksum_files(futures_archive, spot_archive, tmp_path):
+    paths = sorted(a['path'] for a in import_archives.find_archives(str(tmp_path)))
+    assert paths == sorted([futures_archive, spot_archive])
+
+
+def test_verify_checksum(futures_archive):
+    assert import_archives.verify_checksum(futures_archive)
+    assert import_archives.verify_checksum(futures_archive, require=True)
+
+    with open(f"{futures_archive}.CHECKSUM", 'w') as f:
+        f.write('0' * 64 + '  BTCUSDT-1h-2024-01-01.zip\n')
+    assert not import_archives.verify_checksum(futures_archive)
+
+    os.remove(f"{futures_archive}.CHECKSUM")
+    assert import_archives.verify_checksum(futures_archive)
+    assert not import_archives.verify_checksum(futures_archive, require=True)
+
+
+def test_header_row_skipped(futures_archive):
+    header, *data = read_member_rows(futures_archive)
+    assert re.match(import_archives.DATA_ROW_PATTERN, header[0]) is None
+    assert all(re.match(import_archives.DATA_ROW_PATTERN, row[0]) for row in data)
+
+
+def test_microsecond_timestamps(futures_archive, spot_archive):
+    ms_rows = read_member_rows(futures_archive)[1:]
+    us_rows = read_member_rows(spot_archive)
+    threshold = import_archives.MICROSECOND_THRESHOLD
+    assert all(int(row[0]) <= threshold for row in ms_rows)
+    assert all(int(row[0]) > threshold for row in us_rows)
+    # 换算后与毫秒归档的开盘时间一致
+    assert [int(row[0]) // 1000 for row in us_rows] == [int(row[0]) for row in ms_rows]
+
+
+class FakeConnection:
+    """记录SQL和COPY内容的连接，merge_kline_stage 的预编译语句返回固定行数"""
+
+    def __init__(self):
+        self.statements = []
+        self.copied = None
+
+    async def execute(self, query, *args):
+        self.statements.append(query)
+
+    async def copy_to_table(self, table, source, columns, format):
+        assert (table, columns, format) == ('kline_archive_raw', import_archives.ARCHIVE_COLUMNS, 'csv')
+        self.copied = source.read()
+
+    async def prepared(self, query):
+        self.statements.append(query)
+        return types.SimpleNamespace(fetchval=self._fetchval)
+
+    async def fetchval(self, query, *args):
+        self.statements.append(query)
+        return await self._fetchval(*args)
+
+    @staticmethod
+    async def _fetchval(*args):
+        return 2
+
+
+def test_copy_archive_member_streams_csv(futures_archive):
+    conn = FakeConnection()
+    with zipfile.ZipFile(futures_archive) as zf:
+        with zf.open(zf.namelist()[0]) as source:
+            inserted = asyncio.run(import_archives.copy_archive_member(conn, 1, 1, '1h', source))
+
+    assert inserted == 2
+    # CSV原样交给COPY，表头和微秒时间戳在暂存表转换时处理
+    assert conn.copied.decode().splitlines()[0] == FUTURES_HEADER
+    transform = next(q for q in conn.statements if 'INSERT INTO kline_stage' in q)
+    assert f"open_time ~ '{import_archives.DATA_ROW_PATTERN}'" in transform
+    assert f"> {import_archives.MICROSECOND_THRESHOLD} THEN open_time::bigint / 1000" in transform
@@ -1,6 +1,14 @@
 # 创建默认日志记录器
 from datetime import datetime
+from logging import getLogger
 
 from utils.logging import setup_logger
 
-logger = setup_logger('exchange_data', f'exchange_data_{datetime.now().strftime("%Y%m%d")}.log')
+# 导入时不添加处理器、不创建日志文件，由入口程序调用 setup_logging 完成配置
+logger = getLogger('exchange_data')
+
+
+def setup_logging(log_file=True):
+    """为默认日志记录器添加控制台和按日期命名的文件处理器，只在入口程序和子进程入口调用"""
+    return setup_logger('exchange_data',
+                        f'exchange_data_{datetime.now().strftime("%Y%m%d")}.log' if log_file else None)
@@ -1,5 +1,55 @@
 """辅助函数"""
-import asyncio
+import datetime
+import time
+
+# 时间周期对应的毫秒数
+TIMEFRAME_MS = {
+    '1m': 60 * 1000,
+    '5m': 5 * 60 * 1000,
+    '15m': 15 * 60 * 1000,
+    '1h': 60 * 60 * 1000,
+    '4h': 4 * 60 * 60 * 1000,
+    '1d': 24 * 60 * 60 * 1000,
+}
+
+
+def timeframe_to_ms(timeframe):
+    """时间周期转换为毫秒数"""
+    if timeframe not in TIMEFRAME_MS:
+        raise ValueError(f"不支持的时间周期: {timeframe}")
+    return TIMEFRAME_MS[timeframe]
+
+
+def is_window_closed(end_time, timeframe, now_ms=None):
+    """判断以end_time(毫秒)结束的时间窗口内的K线是否都已收盘"""
+    if now_ms is None:
+        now_ms = int(time.time() * 1000)
+    return int(end_time) + timeframe_to_ms(timeframe) <= now_ms
+
+
+def to_ms(value):
+    """datetime或毫秒时间戳转换为毫秒时间戳，naive datetime按UTC处理"""
+    if isinstance(value, datetime.datetime):
+        if not value.tzinfo:
+            value = value.replace(tzinfo=datetime.timezone.utc)
+        return int(value.timestamp() * 1000)
+    return int(value)
+
+
+def split_windows(start_time, end_time, timeframe, bars_per_window):
+    """
+    将[start_time, end_time]毫秒时间范围按每窗口bars_per_window根K线切分
+
+    :return: [(window_start, window_end), ...]，窗口首尾相接且互不重叠
+    """
+    span = timeframe_to_ms(timeframe) * bars_per_window
+    windows = []
+    current = int(start_time)
+    while current <= end_time:
+        window_end = min(current + span - 1, int(end_time))
+        windows.append((current, window_end))
+        current = window_end + 1
+    return windows
 
 
 def format_symbol(exchange, symbol, market_type):
@@ -21,17 +71,6 @@ def format_symbol(exchange, symbol, market_type):
 
 
 async def fetch_with_retry(fetch_func, *args, max_retries=3, **kwargs):
-    """带重试机制的数据获取函数"""
-    retries = 0
-    while retries < max_retries:
-        try:
-            return await fetch_func(*args, **kwargs)
-        except Exception as e:
-            retries += 1
-            if retries >= max_retries:
-                print(f"达到最大重试次数 {max_retries}，操作失败: {str(e)}")
-                raise
-            wait_time = 2 ** retries  # 指数退避策略
-            print(f"操作失败，{wait_time}秒后重试 ({retries}/{max_retries}): {str(e)}")
-            await asyncio.sleep(wait_time)
-    return None
+    """带重试机制的数据获取函数，使用统一的重试策略(去相关抖动，只重试可重试的错误)"""
+    from utils.retry import RetryPolicy
+    return await RetryPolicy(max_retries=max_retries).call_async(fetch_func, *args, **kwargs)
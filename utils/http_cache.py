@@ -0,0 +1,176 @@
+"""HTTP响应缓存与请求合并"""
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+from conf.config import HTTP_CACHE_CONFIG
+from utils.profiling import profiler
+
+
+class CachedResponse:
+    """
+    缓存的HTTP响应，提供与requests.Response相同的常用接口
+
+    json() 只解析一次，校验函数和交易所适配器共用同一个解析结果，调用方不应修改返回的对象
+    """
+
+    def __init__(self, url, status_code, content, headers=None):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+        self._json = None
+        self._decoded = False
+
+    def json(self):
+        if not self._decoded:
+            self._json = json.loads(self.content)
+            self._decoded = True
+        return self._json
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            import requests
+            raise requests.HTTPError(f"HTTP {self.status_code}: {self.url}", response=self)
+
+
+class HttpCache:
+    """
+    按 (endpoint, 规范化参数) 缓存HTTP响应
+
+    - 已完全收盘的历史窗口: 响应不可变，持久化到磁盘
+    - 包含当前时间的窗口: 只在内存中保留ttl秒
+    - 相同的并发请求合并为一次网络调用
+    """
+
+    def __init__(self, cache_dir, ttl, enabled=True):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.enabled = enabled
+        self._memory = {}  # key -> (过期时间, CachedResponse)
+        self._inflight = {}  # key -> Future
+        self._next_purge = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(url, params=None):
+        """根据endpoint和规范化后的参数生成缓存键"""
+        normalized = sorted((str(k), str(v)) for k, v in (params or {}).items())
+        raw = json.dumps([url, normalized], separators=(',', ':'))
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _load(self, key, immutable):
+        """读取缓存，未命中返回None"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, response = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    return response
+                del self._memory[key]
+
+        if immutable:
+            path = self._path(key)
+            try:
+                with open(path, 'rb') as f:
+                    content = f.read()
+            except FileNotFoundError:
+                return None
+            return CachedResponse(path, 200, content)
+        return None
+
+    def _store(self, key, response, immutable):
+        if immutable:
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 先写临时文件再替换，避免并发进程读到半截文件
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(response.content)
+            os.replace(tmp_path, path)
+        else:
+            now = time.monotonic()
+            with self._lock:
+                # 过期的条目只在同一键再次读取时才会删除，每隔ttl秒整体清理一次
+                if now >= self._next_purge:
+                    expired = [k for k, (expires_at, _) in self._memory.items()
+                               if expires_at is not None and expires_at <= now]
+                    for k in expired:
+                        del self._memory[k]
+                    self._next_purge = now + self.ttl
+                self._memory[key] = (now + self.ttl, response)
+
+    def get(self, session, url, params=None, immutable=False, validator=None, limiter=None, weight=1, **kwargs):
+        """
+        带缓存的GET请求
+
+        :param session: requests.Session
+        :param url: 请求地址
+        :param params: 请求参数
+        :param immutable: 响应是否不可变(窗口已完全收盘)，不可变的响应持久化到磁盘
+        :param validator: 校验解析后的JSON是否可缓存，例如过滤交易所的业务错误
+        :param limiter: 限流器，只有实际发出网络请求时才消耗权重
+        :param weight: 请求权重
+        :return: CachedResponse 或 requests.Response
+        """
+        if not self.enabled:
+            if limiter is not None:
+                with profiler.stage('throttle'):
+                    limiter.acquire(weight)
+            with profiler.stage('fetch'):
+                return session.get(url, params=params, **kwargs)
+
+        key = self.make_key(url, params)
+        cached = self._load(key, immutable)
+        if cached is not None:
+            return cached
+
+        # 合并相同的在途请求
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+
+        if not owner:
+            return future.result()
+
+        try:
+            if limiter is not None:
+                with profiler.stage('throttle'):
+                    limiter.acquire(weight)
+            with profiler.stage('fetch'):
+                raw = session.get(url, params=params, **kwargs)
+            response = CachedResponse(raw.url, raw.status_code, raw.content, raw.headers)
+            if response.status_code == 200 and validator is not None:
+                # 解析结果保留在response中，适配器再次调用json()时不会重复解析
+                with profiler.stage('decode'):
+                    cacheable = validator(response.json())
+            else:
+                cacheable = response.status_code == 200
+            if cacheable:
+                self._store(key, response, immutable)
+            future.set_result(response)
+            return response
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def clear(self):
+        """清空内存缓存"""
+        with self._lock:
+            self._memory.clear()
+
+
+# 创建全局HTTP缓存实例
+http_cache = HttpCache(**HTTP_CACHE_CONFIG)
@@ -4,9 +4,11 @@ import sys
 
 
 def setup_logger(name, log_file=None, level=logging.INFO):
-    """设置日志记录器"""
+    """设置日志记录器，已设置过的记录器直接返回，不会重复添加处理器"""
     # 创建日志记录器
     logger = logging.getLogger(name)
+    if logger.handlers:
+        return logger
     logger.setLevel(level)
 
     # 创建控制台处理器
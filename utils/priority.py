@@ -0,0 +1,101 @@
+"""分通道的优先级任务调度"""
+import asyncio
+import heapq
+import itertools
+
+
+def worker_count(lanes, max_concurrent):
+    """调度器实际运行的工作协程数，即max_concurrent与预留总数中的较大者，用于确定连接池大小"""
+    return max(1, max_concurrent, sum(lane.get('reserved', 0) for lane in lanes))
+
+
+class PriorityScheduler:
+    """
+    分通道的优先级任务调度器
+
+    通道按声明顺序决定优先级(如 live > repair > backfill)，每个通道有预留的并发数，
+    预留的工作协程优先执行本通道任务，本通道为空时再按通道优先级执行其他通道的任务；
+    max_concurrent 超出预留总数的部分为共享并发，始终按通道优先级取任务。
+    同一通道内按权重(如24小时成交额)从高到低、再按窗口时间从新到旧执行。
+
+    任务量很大时(如多年的1m回填)通过 add_source 添加惰性的任务来源，通道队列为空时
+    每次只从来源中取出batch_size个任务，内存中的任务数有上限；来源本身应大致按优先顺序产生任务。
+    """
+
+    def __init__(self, lanes, max_concurrent, batch_size=1000):
+        """
+        :param lanes: [{'name': 'live', 'reserved': 1}, ...]，按优先级从高到低排列
+        :param max_concurrent: 总并发数，不足预留总数时以预留总数为准
+        :param batch_size: 每次从任务来源取出的任务数
+        """
+        self.lane_names = [lane['name'] for lane in lanes]
+        self.reserved = {lane['name']: lane.get('reserved', 0) for lane in lanes}
+        self.shared = worker_count(lanes, max_concurrent) - sum(self.reserved.values())
+        self.batch_size = batch_size
+        self._queues = {name: [] for name in self.lane_names}
+        self._sources = {name: [] for name in self.lane_names}
+        self._counter = itertools.count()
+
+    def submit(self, lane, func, *args, weight=0.0, order=0):
+        """
+        提交任务
+
+        :param lane: 通道名称
+        :param func: 协程函数，执行时调用 func(*args)
+        :param weight: 权重，越大越先执行
+        :param order: 同权重下的排序值，越大越先执行(如窗口结束时间)
+        """
+        if lane not in self._queues:
+            raise ValueError(f"未知的任务通道: {lane}")
+        heapq.heappush(self._queues[lane], (-weight, -order, next(self._counter), func, args))
+
+    def add_source(self, lane, tasks):
+        """
+        添加惰性的任务来源
+
+        :param lane: 通道名称
+        :param tasks: 可迭代的 (func, args, weight, order)，在通道队列为空时才分批取出
+        """
+        if lane not in self._sources:
+            raise ValueError(f"未知的任务通道: {lane}")
+        self._sources[lane].append(iter(tasks))
+
+    def pending(self):
+        """各通道已放入队列、待执行的任务数，任务来源中尚未取出的不计入"""
+        return {name: len(queue) for name, queue in self._queues.items()}
+
+    def _fill(self, lane):
+        """通道队列为空时从任务来源取出下一批，返回队列是否有任务"""
+        queue = self._queues[lane]
+        sources = self._sources[lane]
+        while not queue and sources:
+            for func, args, weight, order in itertools.islice(sources[0], self.batch_size):
+                self.submit(lane, func, *args, weight=weight, order=order)
+            if not queue:
+                sources.pop(0)
+        return bool(queue)
+
+    def _next_task(self, preferred=None):
+        """取出下一个任务，优先从preferred通道取"""
+        if preferred is not None and self._fill(preferred):
+            return heapq.heappop(self._queues[preferred])
+        for name in self.lane_names:
+            if self._fill(name):
+                return heapq.heappop(self._queues[name])
+        return None
+
+    async def _worker(self, preferred):
+        while True:
+            item = self._next_task(preferred)
+            if item is None:
+                return
+            _, _, _, func, args = item
+            await func(*args)
+
+    async def run(self):
+        """执行全部任务直到所有通道为空"""
+        workers = []
+        for name in self.lane_names:
+            workers.extend(self._worker(name) for _ in range(self.reserved[name]))
+        workers.extend(self._worker(None) for _ in range(self.shared))
+        await asyncio.gather(*workers)
@@ -0,0 +1,157 @@
+"""下载流程的分阶段计时和采样分析"""
+import collections
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+# 下载流程的阶段，按执行顺序排列
+STAGES = ('plan', 'throttle', 'fetch', 'decode', 'normalize', 'write')
+
+
+class SamplingProfiler:
+    """
+    采样分析器
+
+    后台线程每隔interval秒通过 sys._current_frames 采集所有线程的调用栈，
+    结果为flamegraph.pl / speedscope可直接读取的折叠栈格式
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def write_collapsed(self, path):
+        """写出折叠栈文件，每行为 调用栈 采样次数"""
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class Profiler:
+    """
+    进程级的分阶段计时器，默认关闭，关闭时 stage() 几乎没有开销
+
+    各阶段的耗时在多个线程/协程中累加，总和可能超过墙钟时间
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.output_dir = None
+        self.sampler = None
+        self._stats = {}  # stage -> [次数, 总耗时, 最长耗时]
+        self._started = 0.0
+        self._lock = threading.Lock()
+
+    def start(self, output_dir, sample_interval=None):
+        """
+        开启计时，sample_interval不为空时同时启动采样分析器
+
+        :param output_dir: 结果输出目录
+        :param sample_interval: 采样间隔(秒)
+        """
+        self.enabled = True
+        self.output_dir = output_dir
+        self._stats = {}
+        self._started = time.perf_counter()
+        if sample_interval:
+            self.sampler = SamplingProfiler(sample_interval)
+            self.sampler.start()
+
+    def stop(self, label):
+        """
+        停止计时并写出 {label}-{pid}.stages.json 和 {label}-{pid}.collapsed
+
+        :return: 各阶段统计
+        """
+        if not self.enabled:
+            return {}
+        self.enabled = False
+        if self.sampler is not None:
+            self.sampler.stop()
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        prefix = os.path.join(self.output_dir, f"{label}-{os.getpid()}")
+        summary = self.summary()
+        with open(f"{prefix}.stages.json", 'w') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        if self.sampler is not None:
+            self.sampler.write_collapsed(f"{prefix}.collapsed")
+            self.sampler = None
+        return summary
+
+    def record(self, name, elapsed):
+        with self._lock:
+            stat = self._stats.setdefault(name, [0, 0.0, 0.0])
+            stat[0] += 1
+            stat[1] += elapsed
+            stat[2] = max(stat[2], elapsed)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """统计代码块的耗时"""
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def summary(self):
+        order = {name: i for i, name in enumerate(STAGES)}
+        with self._lock:
+            items = sorted(self._stats.items(), key=lambda item: order.get(item[0], len(STAGES)))
+        stages = {
+            name: {'count': count, 'total': round(total, 6), 'avg': round(total / count, 6), 'max': round(longest, 6)}
+            for name, (count, total, longest) in items
+        }
+        result = {'pid': os.getpid(), 'wall': round(time.perf_counter() - self._started, 6), 'stages': stages}
+        if self.sampler is not None:
+            result['samples'] = self.sampler.samples
+        return result
+
+    @staticmethod
+    def format_summary(summary):
+        """格式化阶段统计"""
+        lines = [f"{'阶段':<12}{'次数':>10}{'总耗时(s)':>14}{'平均(ms)':>12}{'最长(ms)':>12}"]
+        for name, s in summary['stages'].items():
+            lines.append(f"{name:<12}{s['count']:>10}{s['total']:>14.3f}"
+                         f"{s['avg'] * 1000:>12.2f}{s['max'] * 1000:>12.2f}")
+        lines.append(f"墙钟耗时: {summary['wall']:.3f} s")
+        return '\n'.join(lines)
+
+
+# 创建全局分析器实例
+profiler = Profiler()
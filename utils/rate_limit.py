@@ -0,0 +1,52 @@
+"""请求频率限制"""
+import threading
+import time
+
+from conf.config import EXCHANGE_CONFIG
+
+
+class RateLimiter:
+    """令牌桶限流器，按交易所的请求权重计量，线程安全"""
+
+    def __init__(self, weight_per_second, burst=None):
+        self.rate = float(weight_per_second)
+        self.capacity = float(burst if burst is not None else weight_per_second)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, weight):
+        """预留令牌，返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= weight
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self, weight=1):
+        """阻塞直到有足够的令牌"""
+        wait_time = self._reserve(weight)
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(exchange_name):
+    """
+    获取交易所的进程级限流器
+
+    交易所按出口IP限流，每台主机只运行一个下载进程时即为该IP的请求预算
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(exchange_name)
+        if limiter is None:
+            config = EXCHANGE_CONFIG.get(exchange_name, {}).get('rate_limit', {})
+            limiter = RateLimiter(config.get('weight_per_second', 10), config.get('burst'))
+            _limiters[exchange_name] = limiter
+        return limiter
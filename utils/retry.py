@@ -0,0 +1,223 @@
+"""统一的重试策略与熔断器"""
+import asyncio
+import random
+import sys
+import threading
+import time
+
+from conf.config import RETRY_CONFIG
+from utils import logger
+
+# 错误类型
+RATE_LIMIT = 'rate_limit'  # 429/418及交易所限频错误码
+SERVER_ERROR = 'server'  # 5xx及交易所繁忙错误码
+TIMEOUT = 'timeout'  # 超时及连接错误
+FATAL = 'fatal'  # 参数错误等，重试无意义
+
+RETRYABLE_KINDS = (RATE_LIMIT, SERVER_ERROR, TIMEOUT)
+
+
+class RetryableError(Exception):
+    """可重试的请求错误"""
+
+    def __init__(self, kind, message, retry_after=None):
+        super().__init__(message)
+        self.kind = kind
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开，请求被直接拒绝"""
+
+
+def classify_response(status_code, error_code=None, rate_limit_codes=(), server_error_codes=()):
+    """
+    根据HTTP状态码和交易所错误码判断错误类型
+
+    :return: 错误类型，请求成功时返回None
+    """
+    if status_code in (418, 429) or (error_code is not None and error_code in rate_limit_codes):
+        return RATE_LIMIT
+    if status_code >= 500 or (error_code is not None and error_code in server_error_codes):
+        return SERVER_ERROR
+    if status_code >= 400:
+        return FATAL
+    return None
+
+
+def classify_error(error):
+    """判断异常的错误类型"""
+    if isinstance(error, RetryableError):
+        return error.kind
+    # 未导入requests时异常不可能来自requests，不为此加载requests
+    requests = sys.modules.get('requests')
+    if requests is not None and isinstance(error, (requests.Timeout, requests.ConnectionError)):
+        return TIMEOUT
+    return FATAL
+
+
+def parse_retry_after(headers):
+    """解析响应头中的Retry-After(秒)"""
+    try:
+        return float((headers or {}).get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """
+    按endpoint的熔断器
+
+    连续失败failure_threshold次后打开，reset_timeout秒内直接拒绝请求；限频响应带有
+    Retry-After时立即打开，持续时间即为Retry-After。之后进入半开状态只放行一个探测请求，
+    成功则关闭，失败则再次打开。
+    """
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_until = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """是否允许发出请求"""
+        with self._lock:
+            if self._failures < self.failure_threshold:
+                return True
+            if time.monotonic() < self._opened_until or self._probing:
+                return False
+            # 半开状态，只放行一个探测请求
+            self._probing = True
+            return True
+
+    def open_remaining(self):
+        """熔断器剩余的打开时间(秒)，未打开时为0"""
+        with self._lock:
+            if self._failures < self.failure_threshold:
+                return 0.0
+            return max(0.0, self._opened_until - time.monotonic())
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self, open_for=None):
+        """
+        记录一次失败
+
+        :param open_for: 强制打开的秒数(如418封禁或Retry-After)
+        """
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if open_for is not None:
+                self._failures = max(self._failures, self.failure_threshold)
+            if self._failures >= self.failure_threshold:
+                # 交易所明确给出了等待时间时以其为准，否则按reset_timeout
+                duration = open_for if open_for is not None else self.reset_timeout
+                self._opened_until = time.monotonic() + duration
+                logger.warning(f"{self.name} 熔断器打开，{duration:.0f} 秒内暂停请求")
+
+
+class RetryPolicy:
+    """带去相关抖动(decorrelated jitter)的重试策略，只重试可重试的错误"""
+
+    def __init__(self, max_retries=None, base_delay=None, max_delay=None):
+        self.max_retries = RETRY_CONFIG['max_retries'] if max_retries is None else max_retries
+        self.base_delay = RETRY_CONFIG['base_delay'] if base_delay is None else base_delay
+        self.max_delay = RETRY_CONFIG['max_delay'] if max_delay is None else max_delay
+
+    def next_delay(self, previous):
+        """下一次重试的等待时间: min(max_delay, uniform(base_delay, previous * 3))"""
+        return min(self.max_delay, random.uniform(self.base_delay, max(self.base_delay, previous) * 3))
+
+    def _on_error(self, error, attempt, previous_delay, breaker):
+        """处理一次失败，返回等待时间；不可重试时重新抛出异常"""
+        kind = classify_error(error)
+        retry_after = getattr(error, 'retry_after', None)
+        if breaker is not None:
+            if kind in RETRYABLE_KINDS:
+                breaker.record_failure(retry_after if kind == RATE_LIMIT else None)
+            else:
+                # 服务端正常响应了请求，endpoint本身可用
+                breaker.record_success()
+        if kind not in RETRYABLE_KINDS or attempt >= self.max_retries:
+            raise error
+
+        delay = self.next_delay(previous_delay)
+        if retry_after:
+            delay = max(delay, retry_after)
+        logger.warning(f"请求失败({kind})，{delay:.2f} 秒后重试 ({attempt + 1}/{self.max_retries}): {str(error)}")
+        return delay
+
+    def _wait_for_breaker(self, breaker, attempt, previous_delay):
+        """
+        熔断器拒绝请求时的等待时间，计为一次尝试；重试次数用完时抛出CircuitOpenError
+
+        熔断器打开时等到其关闭，其他任务正在探测时按退避时间等待
+        """
+        if attempt >= self.max_retries:
+            raise CircuitOpenError(f"{breaker.name} 熔断中，请求已拒绝")
+        delay = breaker.open_remaining() or self.next_delay(previous_delay)
+        logger.warning(f"{breaker.name} 熔断中，{delay:.2f} 秒后重试 ({attempt + 1}/{self.max_retries})")
+        return delay
+
+    def call(self, func, *args, breaker=None, **kwargs):
+        """同步调用(在工作线程中使用)"""
+        delay = self.base_delay
+        attempt = 0
+        while True:
+            if breaker is not None and not breaker.allow():
+                delay = self._wait_for_breaker(breaker, attempt, delay)
+                attempt += 1
+                time.sleep(delay)
+                continue
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                delay = self._on_error(e, attempt, delay, breaker)
+                attempt += 1
+                time.sleep(delay)
+                continue
+            if breaker is not None:
+                breaker.record_success()
+            return result
+
+    async def call_async(self, func, *args, breaker=None, **kwargs):
+        """异步调用，func为协程函数"""
+        delay = self.base_delay
+        attempt = 0
+        while True:
+            if breaker is not None and not breaker.allow():
+                delay = self._wait_for_breaker(breaker, attempt, delay)
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                delay = self._on_error(e, attempt, delay, breaker)
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            if breaker is not None:
+                breaker.record_success()
+            return result
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(name):
+    """获取进程内共享的熔断器，同一endpoint的所有任务共用"""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name, RETRY_CONFIG['failure_threshold'], RETRY_CONFIG['reset_timeout'])
+            _breakers[name] = breaker
+        return breaker
@@ -0,0 +1,93 @@
+"""分布式工作模式：多台主机通过Postgres任务队列协同下载"""
+import asyncio
+import os
+import socket
+
+from conf.config import WORKER_CONFIG
+from db import jobs
+from db.connection import db_manager
+from db.schema import ensure_schema
+from exchanges import get_exchange
+from utils import logger
+
+
+class DistributedWorker:
+    """
+    分布式下载工作进程
+
+    任务窗口存放在 download_jobs 表中，任意数量的工作进程(可分布在不同主机)
+    通过 FOR UPDATE SKIP LOCKED 领取任务，定期续约；进程退出或失联后租约过期，
+    任务会被其他工作进程重新领取。每个工作进程使用本机出口IP的独立限流预算。
+    """
+
+    def __init__(self, worker_id=None, exchange_names=None, concurrency=None, exit_when_idle=False):
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.exchange_names = exchange_names
+        self.concurrency = concurrency or WORKER_CONFIG['concurrency']
+        self.exit_when_idle = exit_when_idle
+        self.lease_seconds = WORKER_CONFIG['lease_seconds']
+        self.max_attempts = WORKER_CONFIG['max_attempts']
+        self._exchanges = {}
+        self._active = set()
+
+    def _get_exchange(self, name):
+        """每个交易所只创建一个实例，复用HTTP会话和限流器"""
+        if name not in self._exchanges:
+            self._exchanges[name] = get_exchange(name)
+        return self._exchanges[name]
+
+    async def _heartbeat(self):
+        """定期为正在执行的任务续约"""
+        while True:
+            await asyncio.sleep(WORKER_CONFIG['heartbeat_seconds'])
+            try:
+                await jobs.renew_leases(self.worker_id, self._active, self.lease_seconds)
+            except Exception as e:
+                logger.error(f"工作进程 {self.worker_id} 续约失败: {str(e)}")
+
+    async def _run_job(self, job):
+        exchange = self._get_exchange(job['exchange_name'])
+        self._active.add(job['job_id'])
+        try:
+            await exchange.download_data(
+                symbol=job['symbol'],
+                timeframe=job['timeframe'],
+                start_time=job['start_time'],
+                end_time=job['end_time'],
+                market_type=job['market_type'],
+                dataset=job['dataset']
+            )
+            await jobs.complete_job(self.worker_id, job['job_id'])
+        except Exception as e:
+            logger.error(f"任务 {job['job_id']} 执行失败: {str(e)}")
+            await jobs.fail_job(self.worker_id, job['job_id'], str(e), self.max_attempts)
+        finally:
+            self._active.discard(job['job_id'])
+
+    async def _consume(self):
+        """循环领取并执行任务"""
+        while True:
+            claimed = await jobs.claim_jobs(self.worker_id, 1, self.lease_seconds,
+                                            self.max_attempts, self.exchange_names)
+            if not claimed:
+                if self.exit_when_idle:
+                    return
+                await asyncio.sleep(WORKER_CONFIG['poll_seconds'])
+                continue
+            await self._run_job(claimed[0])
+
+    async def run(self):
+        """启动工作进程，exit_when_idle 为 True 时在队列为空后退出"""
+        db_manager.configure(concurrency=self.concurrency)
+        await db_manager.create_pool()
+        heartbeat = None
+        try:
+            await ensure_schema()
+            logger.info(f"工作进程 {self.worker_id} 已启动，并发数: {self.concurrency}")
+            heartbeat = asyncio.create_task(self._heartbeat())
+            await asyncio.gather(*(self._consume() for _ in range(self.concurrency)))
+            logger.info(f"工作进程 {self.worker_id} 没有待执行的任务，退出")
+        finally:
+            if heartbeat:
+                heartbeat.cancel()
+            await db_manager.close_pool()